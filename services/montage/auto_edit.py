@@ -1,10 +1,106 @@
 #!/usr/bin/env python3
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import json
+import os
+import re
+import shlex
+import shutil
 import time
 from pathlib import Path
 import subprocess
-from typing import Optional
+import threading
+from typing import List, Optional, Tuple
+
+
+# x264 preset names mapped onto the closest NVENC p1 (fastest) .. p7 (slowest) preset
+NVENC_PRESETS = {
+    "ultrafast": "p1",
+    "superfast": "p1",
+    "veryfast": "p2",
+    "faster": "p3",
+    "fast": "p3",
+    "medium": "p4",
+    "slow": "p6",
+    "slower": "p7",
+    "veryslow": "p7",
+}
+
+# Resolved once; when ffmpeg is missing run() writes the placeholder without building a command
+_FFMPEG_BIN = shutil.which("ffmpeg")
+
+# A filter chain: leading [input] pads, the filters, trailing [output] pads
+_CHAIN_RE = re.compile(r"^((?:\[[^\]]+\])*)(.*?)((?:\[[^\]]+\])*)$")
+_PAD_RE = re.compile(r"\[([^\]]+)\]")
+_STREAM_REF_RE = re.compile(r"^(\d+):[va]\??$")
+
+# Music ducking under the voice (sidechaincompress attack/release are in milliseconds)
+DUCK_THRESHOLD_DB = -20
+DUCK_RATIO = 8
+DUCK_ATTACK_MS = 20
+DUCK_RELEASE_MS = 300
+
+# Single-pass EBU R128 normalization of the composed audio; -14 LUFS is the usual short-form platform target
+TARGET_LUFS = -14.0
+LOUDNORM_TRUE_PEAK = -1.5
+LOUDNORM_LRA = 11
+
+# Compositions sharing one ffmpeg process in run_batch; each output keeps its own encoder alive
+BATCH_SIZE = 8
+# Concurrent NVENC sessions allowed on consumer GeForce cards; every batched output opens one
+NVENC_MAX_SESSIONS = 3
+
+# Stream fields _probe_clip reads; each clip is probed once per composition, so nothing is cached
+CLIP_PROBE_FIELDS = "codec_name,width,height,r_frame_rate,pix_fmt"
+
+# Output spec of the vertical clips produced by services/vision
+TARGET_WIDTH = 1080
+TARGET_HEIGHT = 1920
+TARGET_FPS = 30.0
+
+# Subtitle style baked into the generated ASS file and forced onto the subtitles= fallback
+# PlayRes matches the output frame so libass renders at final size without rescaling glyphs
+ASS_FONT = "Arial"
+ASS_FONT_SIZE = 72
+ASS_MARGIN = 60
+ASS_OUTLINE = 4
+ASS_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: 1080
+PlayResY: 1920
+ScaledBorderAndShadow: yes
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,{font},{size},&H00FFFFFF,&H00FFFFFF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,{outline},0,2,{margin},{margin},{margin},1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+# Style for the subtitles= filter, used on the SRT itself when it cannot be converted to ASS
+# Same PlayRes and style as the ASS header, so captions render at one size whichever path runs
+SUBTITLES_FORCE_STYLE = (
+    f"PlayResX={TARGET_WIDTH},PlayResY={TARGET_HEIGHT},ScaledBorderAndShadow=yes,"
+    f"FontName={ASS_FONT},FontSize={ASS_FONT_SIZE},PrimaryColour=&H00FFFFFF,OutlineColour=&H00000000,"
+    f"BorderStyle=1,Outline={ASS_OUTLINE},Shadow=0,Alignment=2,"
+    f"MarginL={ASS_MARGIN},MarginR={ASS_MARGIN},MarginV={ASS_MARGIN}"
+)
+
+# SRT markup translated to ASS overrides, as ffmpeg's SRT decoder does
+_SRT_TAG_RE = re.compile(r"<(/?)([ibus])>|<font\b([^>]*)>|</font>", re.IGNORECASE)
+_FONT_COLOR_RE = re.compile(r"""color\s*=\s*["']?#([0-9a-f]{6})""", re.IGNORECASE)
+
+# Text written in place of the composed video when ffmpeg is missing or fails
+PLACEHOLDER_TEMPLATE = """# Placeholder composition file
+# Input: {clip}
+# Voice: {voice}
+# Music: {music}
+# Subtitles: {subs}
+# Would be: Final composed 9:16 video
+# Error: {error}
+"""
 
 
 def run(
@@ -15,9 +111,17 @@ def run(
     srt_path: Optional[Path] = None,
     no_burn: bool = False,
     dry_run: bool = False,
-    json_output: bool = False
+    json_output: bool = False,
+    preset: str = "faster",
+    quiet: bool = False,
+    threads: int = 0,
+    target_lufs: Optional[float] = TARGET_LUFS
 ) -> None:
-    """Compose final short with video, voice, music, and subtitles."""
+    """
+    Compose final short with video, voice, music, and subtitles.
+    threads caps the encoder threads (0 lets ffmpeg pick), e.g. when several compositions run side by side.
+    Added voice/music is loudness-normalized to target_lufs; None leaves the levels alone.
+    """
     start_time = time.time()
     
     print(f"Clip: {clip_path}")
@@ -26,6 +130,9 @@ def run(
     print(f"Music: {music_path}")
     print(f"Subtitles: {srt_path}")
     print(f"Burn subtitles: {not no_burn}")
+    print(f"Preset: {preset}")
+    print(f"Threads: {threads or 'auto'}")
+    print(f"Target loudness: {f'{target_lufs:g} LUFS' if target_lufs is not None else 'off'}")
     
     if not clip_path.exists():
         print(f"Error: Clip file {clip_path} does not exist")
@@ -39,125 +146,730 @@ def run(
         print(f"  {out_path}")
         return
     
-    # Build ffmpeg command
-    cmd = _build_ffmpeg_command(clip_path, out_path, voice_path, music_path, srt_path, no_burn)
+    if _FFMPEG_BIN is None:
+        print("Warning: ffmpeg not found. Creating placeholder composition file...")
+        _write_placeholder(out_path, clip_path, voice_path, music_path, srt_path, "ffmpeg not found in PATH")
+        return
+    
+    clip_info, ass_path = _prepare_inputs(clip_path, out_path, srt_path, no_burn)
+    
+    # Build ffmpeg command; it writes beside the output and is renamed into place on success
+    part_path = _part_path(out_path)
+    cmd = _build_ffmpeg_command(
+        clip_path, part_path, voice_path, music_path, ass_path, no_burn, preset,
+        clip_info=clip_info, threads=threads, target_lufs=target_lufs
+    )
     
     try:
         print("Composing final short...")
-        subprocess.run(cmd, check=True, capture_output=True)
+        _run_ffmpeg(cmd, quiet)
+        os.replace(part_path, out_path)
         
         elapsed = time.time() - start_time
         print(f"Completed in {elapsed:.1f}s")
         
         if json_output:
-            result = {
-                "input_clip": str(clip_path),
-                "output": str(out_path),
-                "voice": str(voice_path) if voice_path else None,
-                "music": str(music_path) if music_path else None,
-                "subtitles": str(srt_path) if srt_path else None,
-                "burn_subtitles": not no_burn,
-                "elapsed_sec": elapsed
-            }
-            print(json.dumps(result, indent=2))
-            
+            result = _composition_summary(clip_path, out_path, voice_path, music_path, srt_path, no_burn)
+            result["elapsed_sec"] = elapsed
+            _print_json(result)
+    
     except (FileNotFoundError, subprocess.CalledProcessError) as e:
+        part_path.unlink(missing_ok=True)
         print("Warning: ffmpeg failed. Creating placeholder composition file...")
-        out_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(out_path, 'w') as f:
-            f.write(f"# Placeholder composition file\n")
-            f.write(f"# Input: {clip_path}\n")
-            f.write(f"# Voice: {voice_path if voice_path else 'None'}\n")
-            f.write(f"# Music: {music_path if music_path else 'None'}\n")
-            f.write(f"# Subtitles: {srt_path if srt_path else 'None'}\n")
-            f.write(f"# Would be: Final composed 9:16 video\n")
-            f.write(f"# Error: {e}\n")
-        print(f"Created placeholder: {out_path}")
+        error = str(e)
+        if getattr(e, "stderr", None):
+            error += f"\n# ffmpeg: {e.stderr.decode(errors='replace').strip()[-500:]}"
+        _write_placeholder(out_path, clip_path, voice_path, music_path, srt_path, error)
 
 
-def _build_ffmpeg_command(
+def run_batch(
+    jobs: List[dict],
+    preset: str = "faster",
+    quiet: bool = False,
+    batch_size: Optional[int] = None,
+    threads: int = 0,
+    target_lufs: Optional[float] = TARGET_LUFS,
+    dry_run: bool = False,
+    json_output: bool = False
+) -> None:
+    """
+    Compose several shorts, sharing one ffmpeg process per batch_size jobs to amortize startup.
+    Each job holds run() keyword arguments: clip_path, out_path and optionally voice_path, music_path, srt_path, no_burn.
+    batch_size defaults to BATCH_SIZE, capped at NVENC_MAX_SESSIONS when encoding on NVENC.
+    """
+    start_time = time.time()
+    
+    jobs = [job for job in jobs if _check_clip(job["clip_path"])]
+    for job in jobs:
+        job["out_path"].parent.mkdir(parents=True, exist_ok=True)
+    
+    if dry_run:
+        _print_batch_plan(jobs, preset, batch_size, threads, target_lufs, json_output)
+        return
+    
+    if _FFMPEG_BIN is None:
+        print("Warning: ffmpeg not found. Creating placeholder composition files...")
+        for job in jobs:
+            _write_placeholder(
+                job["out_path"], job["clip_path"], job.get("voice_path"), job.get("music_path"),
+                job.get("srt_path"), "ffmpeg not found in PATH"
+            )
+        return
+    
+    batch_size = _resolve_batch_size(batch_size)
+    for i in range(0, len(jobs), batch_size):
+        chunk = jobs[i:i + batch_size]
+        with ThreadPoolExecutor(max_workers=len(chunk)) as ex:
+            prepared = list(ex.map(
+                lambda job: _prepare_inputs(
+                    job["clip_path"], job["out_path"], job.get("srt_path"), job.get("no_burn", False)
+                ),
+                chunk
+            ))
+        
+        staged = [dict(job, out_path=_part_path(job["out_path"])) for job in chunk]
+        cmd = _build_batch_command(staged, prepared, preset, threads=threads, target_lufs=target_lufs)
+        try:
+            print(f"Composing {len(chunk)} shorts in one ffmpeg run...")
+            _run_ffmpeg(cmd, quiet)
+            for job, staged_job in zip(chunk, staged):
+                os.replace(staged_job["out_path"], job["out_path"])
+        except (FileNotFoundError, subprocess.CalledProcessError):
+            for staged_job in staged:
+                staged_job["out_path"].unlink(missing_ok=True)
+            # One bad input fails the whole run; retry individually so the others still get composed
+            print("Warning: batch composition failed, composing shorts one by one...")
+            for job in chunk:
+                run(**job, preset=preset, quiet=quiet, threads=threads, target_lufs=target_lufs)
+    
+    elapsed = time.time() - start_time
+    print(f"Completed {len(jobs)} shorts in {elapsed:.1f}s")
+    
+    if json_output:
+        result = {"shorts": [_job_summary(job) for job in jobs], "elapsed_sec": elapsed}
+        _print_json(result)
+
+
+def _resolve_batch_size(batch_size: Optional[int]) -> int:
+    """Default to BATCH_SIZE, or NVENC_MAX_SESSIONS when every batched output opens an NVENC session."""
+    if batch_size is not None:
+        return batch_size
+    return min(BATCH_SIZE, NVENC_MAX_SESSIONS) if _detect_nvenc() else BATCH_SIZE
+
+
+def _print_batch_plan(
+    jobs: List[dict],
+    preset: str,
+    batch_size: Optional[int],
+    threads: int,
+    target_lufs: Optional[float],
+    json_output: bool
+) -> None:
+    """Print the ffmpeg run each batch would make, without converting subtitles or encoding anything."""
+    batch_size = _resolve_batch_size(batch_size)
+    batches = []
+    for i in range(0, len(jobs), batch_size):
+        chunk = jobs[i:i + batch_size]
+        # Subtitles stay SRT (the subtitles= filter) in the plan; the real run burns in the converted ASS
+        prepared = [(_probe_clip(job["clip_path"]), job.get("srt_path")) for job in chunk]
+        staged = [dict(job, out_path=_part_path(job["out_path"])) for job in chunk]
+        cmd = _build_batch_command(staged, prepared, preset, threads=threads, target_lufs=target_lufs)
+        batches.append({"shorts": [_job_summary(job) for job in chunk], "command": cmd})
+    
+    print(f"Dry run - would compose {len(jobs)} shorts in {len(batches)} ffmpeg runs:")
+    for batch in batches:
+        for short in batch["shorts"]:
+            print(f"  {short['output']}")
+        print(f"    {shlex.join(batch['command'])}")
+    
+    if json_output:
+        _print_json({"dry_run": True, "batches": batches})
+
+
+def _print_json(obj) -> None:
+    """
+    Print a --json summary formatted like services/vision/utils.dumps_json without orjson.
+    It stays on the stdlib: these summaries are small, and importing vision's utils would need it on sys.path.
+    """
+    print(json.dumps(obj, indent=2, ensure_ascii=False))
+
+
+def _job_summary(job: dict) -> dict:
+    """Summarize a run_batch job the way run() reports a single composition."""
+    return _composition_summary(
+        job["clip_path"], job["out_path"], job.get("voice_path"), job.get("music_path"),
+        job.get("srt_path"), job.get("no_burn", False)
+    )
+
+
+def _composition_summary(
     clip_path: Path,
     out_path: Path,
     voice_path: Optional[Path],
     music_path: Optional[Path],
     srt_path: Optional[Path],
     no_burn: bool
+) -> dict:
+    """Describe a composition's inputs and output for --json."""
+    return {
+        "input_clip": str(clip_path),
+        "output": str(out_path),
+        "voice": str(voice_path) if voice_path else None,
+        "music": str(music_path) if music_path else None,
+        "subtitles": str(srt_path) if srt_path else None,
+        "burn_subtitles": not no_burn
+    }
+
+
+def _check_clip(clip_path: Path) -> bool:
+    """Report and skip batch jobs whose clip is missing."""
+    if clip_path.exists():
+        return True
+    print(f"Error: Clip file {clip_path} does not exist, skipping")
+    return False
+
+
+def _part_path(out_path: Path) -> Path:
+    """
+    Return the temporary path ffmpeg writes to before it is renamed to out_path.
+    Same naming as services/vision/utils.part_path: <name>.mp4.part stays out of *.mp4 listings, so outputs pass -f mp4.
+    """
+    return out_path.with_name(f"{out_path.name}.part")
+
+
+def _write_placeholder(
+    out_path: Path,
+    clip_path: Path,
+    voice_path: Optional[Path],
+    music_path: Optional[Path],
+    srt_path: Optional[Path],
+    error: str
+) -> None:
+    """Write a text placeholder in place of the composed video, as a single write."""
+    out_path.write_bytes(PLACEHOLDER_TEMPLATE.format(
+        clip=clip_path, voice=voice_path, music=music_path, subs=srt_path, error=error
+    ).encode('utf-8'))
+    print(f"Created placeholder: {out_path}")
+
+
+def _build_ffmpeg_command(
+    clip_path: Path,
+    out_path: Path,
+    voice_path: Optional[Path],
+    music_path: Optional[Path],
+    ass_path: Optional[Path],
+    no_burn: bool,
+    preset: str = "faster",
+    crf: int = 20,
+    clip_info: Optional[dict] = None,
+    threads: int = 0,
+    target_lufs: Optional[float] = TARGET_LUFS
 ) -> list:
-    """Build ffmpeg command for video composition."""
-    cmd = ["ffmpeg", "-y"]
+    """
+    Build ffmpeg command for video composition.
+    clip_info is the _probe_clip result; when it shows the clip already matches the output spec and
+    there is nothing to mix or burn in, the streams are copied instead of re-encoded.
+    """
+    input_args, filter_graph, output_args = _composition_args(
+        clip_path, out_path, voice_path, music_path, ass_path, no_burn, preset, crf, clip_info,
+        threads=threads, target_lufs=target_lufs
+    )
+    
+    _check_filter_graph(filter_graph, input_args.count("-i"), output_args)
+    
+    cmd = list(_global_args())
+    cmd.extend(input_args)
+    if filter_graph:
+        cmd.extend(["-filter_complex", ";".join(filter_graph)])
+    cmd.extend(output_args)
+    
+    return cmd
+
+
+def _build_batch_command(
+    jobs: List[dict],
+    prepared: List[tuple],
+    preset: str,
+    crf: int = 20,
+    threads: int = 0,
+    target_lufs: Optional[float] = TARGET_LUFS
+) -> list:
+    """Build a single ffmpeg command composing every job, each with its own inputs, subgraph and output."""
+    cmd = list(_global_args())
+    filter_graph = []
+    output_args = []
+    first_index = 0
+    
+    for n, (job, (clip_info, ass_path)) in enumerate(zip(jobs, prepared), start=1):
+        job_inputs, job_graph, job_outputs = _composition_args(
+            job["clip_path"], job["out_path"], job.get("voice_path"), job.get("music_path"),
+            ass_path, job.get("no_burn", False), preset, crf, clip_info,
+            first_index=first_index, label=str(n), threads=threads, target_lufs=target_lufs
+        )
+        cmd.extend(job_inputs)
+        filter_graph.extend(job_graph)
+        output_args.extend(job_outputs)
+        first_index += job_inputs.count("-i")
+    
+    _check_filter_graph(filter_graph, first_index, output_args)
+    
+    if filter_graph:
+        cmd.extend(["-filter_complex", ";".join(filter_graph)])
+    cmd.extend(output_args)
+    
+    return cmd
+
+
+def _check_filter_graph(filter_graph: List[str], input_count: int, output_args: list) -> None:
+    """
+    Validate pad wiring before spawning ffmpeg: every input reference must exist, and every labelled
+    pad must be produced once and consumed once (by another chain or a -map).
+    A miswired graph otherwise only fails inside ffmpeg, possibly after the inputs were opened and probed.
+    """
+    produced = []
+    consumed = []
+    for chain in filter_graph:
+        inputs, _, outputs = _CHAIN_RE.match(chain).groups()
+        consumed.extend(_PAD_RE.findall(inputs))
+        produced.extend(_PAD_RE.findall(outputs))
+    
+    maps = [output_args[i + 1] for i, arg in enumerate(output_args) if arg == "-map"]
+    consumed.extend(m[1:-1] for m in maps if m.startswith("["))
+    stream_refs = [m for m in maps if not m.startswith("[")]
+    
+    for pad in consumed + stream_refs:
+        ref = _STREAM_REF_RE.match(pad)
+        if ref:
+            if int(ref.group(1)) >= input_count:
+                raise ValueError(f"Filter graph references missing input {pad}")
+        elif pad not in produced:
+            raise ValueError(f"Filter graph consumes undefined pad [{pad}]")
+    
+    labels = [pad for pad in consumed if not _STREAM_REF_RE.match(pad)]
+    for pad in set(produced):
+        if produced.count(pad) > 1:
+            raise ValueError(f"Filter graph defines pad [{pad}] more than once")
+        if labels.count(pad) != 1:
+            raise ValueError(f"Filter graph pad [{pad}] must be consumed exactly once")
+
+
+def _composition_args(
+    clip_path: Path,
+    out_path: Path,
+    voice_path: Optional[Path],
+    music_path: Optional[Path],
+    ass_path: Optional[Path],
+    no_burn: bool,
+    preset: str,
+    crf: int,
+    clip_info: Optional[dict],
+    first_index: int = 0,
+    label: str = "",
+    threads: int = 0,
+    target_lufs: Optional[float] = TARGET_LUFS
+) -> Tuple[list, list, list]:
+    """
+    Return (input args, filter chains, output args) for one composition.
+    first_index and label let several compositions share one ffmpeg process without clashing.
+    """
+    input_args = []
+    
+    # Stat each optional input exactly once
+    have = {
+        name: path is not None and path.exists()
+        for name, path in (("voice", voice_path), ("music", music_path), ("subs", ass_path))
+    }
+    
+    burn_subtitles = have["subs"] and not no_burn
+    stream_copy = (
+        not burn_subtitles and not have["voice"] and not have["music"]
+        and _matches_target(clip_info)
+    )
+    use_nvenc = not stream_copy and _detect_nvenc()
+    frames_on_gpu = use_nvenc and not burn_subtitles
+    
+    # Decode on the GPU when encoding with NVENC; frames can only stay in
+    # CUDA memory if no software filter (subtitles) has to touch them
+    if use_nvenc:
+        input_args.extend(["-hwaccel", "cuda"])
+        if frames_on_gpu:
+            input_args.extend(["-hwaccel_output_format", "cuda"])
     
     # Input files
-    cmd.extend(["-i", str(clip_path)])
+    clip_index = first_index
+    input_args.extend(["-i", str(clip_path)])
+    
+    # Track input indices so the music stream is addressed correctly with or without voice
+    voice_index = None
+    music_index = None
+    next_index = clip_index + 1
     
-    if voice_path and voice_path.exists():
-        cmd.extend(["-i", str(voice_path)])
+    if have["voice"]:
+        input_args.extend(["-i", str(voice_path)])
+        voice_index = next_index
+        next_index += 1
     
-    if music_path and music_path.exists():
-        cmd.extend(["-i", str(music_path)])
+    if have["music"]:
+        input_args.extend(["-i", str(music_path)])
+        music_index = next_index
     
     # Video filters
     video_filters = []
     
+    # Convert the frame rate only when needed, ahead of any other video filter
+    if not (clip_info and abs(clip_info["fps"] - TARGET_FPS) < 0.01):
+        video_filters.append(f"fps={TARGET_FPS:g}")
+    
     # Add subtitle burn-in if requested
-    if srt_path and srt_path.exists() and not no_burn:
-        video_filters.append(f"subtitles={srt_path}:force_style='FontSize=24,PrimaryColour=&Hffffff,OutlineColour=&H000000,Outline=2'")
+    if burn_subtitles and ass_path.suffix.lower() == ".ass":
+        video_filters.append(f"ass={_escape_filter_value(str(ass_path))}")
+    elif burn_subtitles:
+        video_filters.append(
+            f"subtitles={_escape_filter_value(str(ass_path))}:force_style='{SUBTITLES_FORCE_STYLE}'"
+        )
     
     # Audio filters
     audio_filters = []
+    audio_label = f"[final_audio{label}]"
+    # Normalize mixes carrying the voice; music alone keeps its background level and clip audio passes through
+    loudnorm = (
+        f",loudnorm=I={target_lufs:g}:TP={LOUDNORM_TRUE_PEAK}:LRA={LOUDNORM_LRA}:dual_mono=true"
+        if target_lufs is not None else ""
+    )
     
-    if voice_path and voice_path.exists() and music_path and music_path.exists():
-        # Mix voice and music with ducking
+    if voice_index is not None and music_index is not None:
+        # Split the voice so one branch is mixed and the other drives the music ducking
         audio_filters.extend([
-            "[0:a][1:a]amix=inputs=2:duration=first:dropout_transition=2[voice_music]",
-            "[2:a]volume=0.3[music_quiet]",
-            "[voice_music][music_quiet]amix=inputs=2:duration=first:dropout_transition=2[final_audio]"
+            f"[{voice_index}:a]asplit=2[voice_a{label}][voice_sc{label}]",
+            f"[{music_index}:a][voice_sc{label}]sidechaincompress=threshold={DUCK_THRESHOLD_DB}dB:ratio={DUCK_RATIO}"
+            f":attack={DUCK_ATTACK_MS}:release={DUCK_RELEASE_MS}[music_ducked{label}]",
+            f"[voice_a{label}][music_ducked{label}]amix=inputs=2:duration=first:weights='1.0 0.3':dropout_transition=2{loudnorm}{audio_label}",
         ])
-    elif voice_path and voice_path.exists():
+    elif voice_index is not None:
         # Just voice
-        audio_filters.append("[1:a]volume=1.0[final_audio]")
-    elif music_path and music_path.exists():
+        audio_filters.append(f"[{voice_index}:a]volume=1.0{loudnorm}{audio_label}")
+    elif music_index is not None:
         # Just music
-        audio_filters.append("[2:a]volume=0.5[final_audio]")
-    else:
-        # Use original audio
-        audio_filters.append("[0:a]volume=1.0[final_audio]")
+        audio_filters.append(f"[{music_index}:a]volume=0.5{audio_label}")
     
-    # Apply filters
+    # Video and audio chains go into one graph so the branches are scheduled independently
+    filter_graph = list(audio_filters)
+    video_map = f"{clip_index}:v"
     if video_filters:
-        cmd.extend(["-vf", ",".join(video_filters)])
+        video_map = f"[vout{label}]"
+        filter_graph.insert(0, f"[{clip_index}:v]" + ",".join(video_filters) + video_map)
+    
+    # Without voice or music the clip's own audio (if any) passes through untouched
+    audio_map = audio_label if audio_filters else f"{clip_index}:a?"
+    output_args = ["-map", video_map, "-map", audio_map]
     
-    if audio_filters:
-        cmd.extend(["-af", ",".join(audio_filters)])
-        cmd.extend(["-map", "0:v", "-map", "[final_audio]"])
-    else:
-        cmd.extend(["-map", "0:v", "-map", "0:a"])
+    # Put the moov atom up front so uploads can start processing before the whole file is read
+    # The muxer is named since outputs are staged under a .part name
+    output_args.extend(["-movflags", "+faststart", "-f", "mp4"])
+    
+    if stream_copy:
+        output_args.extend(["-c", "copy", str(out_path)])
+        return input_args, filter_graph, output_args
     
     # Output settings
-    cmd.extend([
-        "-c:v", "libx264", "-preset", "veryfast", "-crf", "20",
-        "-c:a", "aac", "-b:a", "192k",
-        "-r", "30",  # 30fps
-        str(out_path)
-    ])
+    output_args.extend(_video_encoder_args(preset, crf, use_nvenc))
+    if threads:
+        output_args.extend(["-threads", str(threads)])
+    # Convert pixel format only when the source is not already yuv420p (CUDA frames keep theirs)
+    if not frames_on_gpu and not (clip_info and clip_info.get("pix_fmt") == "yuv420p"):
+        output_args.extend(["-pix_fmt", "yuv420p"])
+    output_args.extend(_audio_encoder_args())
+    # Narration is 44.1kHz, so keep that rate instead of letting the filter graph pick 48kHz
+    output_args.extend(["-ar", "44100", "-ac", "2", str(out_path)])
     
-    return cmd
+    return input_args, filter_graph, output_args
+
+
+def _escape_filter_value(value: str) -> str:
+    """
+    Escape a filter option value (such as a file path) for use inside -filter_complex.
+    ffmpeg unescapes twice: once for the graph (\\ ' [ ] , ;) and once for the filter's options (\\ ' :).
+    """
+    for special in "\\':":
+        value = value.replace(special, "\\" + special)
+    for special in "\\'[],;":
+        value = value.replace(special, "\\" + special)
+    return value
+
+
+def _run_ffmpeg(cmd: list, quiet: bool) -> None:
+    """Run ffmpeg keeping only its (error-level) stderr in memory; print progress unless quiet."""
+    if quiet:
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        return
+    
+    proc = subprocess.Popen(
+        cmd[:1] + ["-progress", "pipe:1"] + cmd[1:],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    # Drain stderr on a thread so a full pipe can never stall ffmpeg while we read progress
+    stderr_chunks = []
+    reader = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True)
+    reader.start()
+    
+    for line in proc.stdout:
+        key, _, value = line.strip().partition("=")
+        if key == "out_time":
+            print(f"  Encoded {value.split('.')[0]}", flush=True)
+    
+    proc.wait()
+    reader.join()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(
+            proc.returncode, cmd, stderr="".join(stderr_chunks).encode()
+        )
+
+
+def _prepare_inputs(
+    clip_path: Path,
+    out_path: Path,
+    srt_path: Optional[Path],
+    no_burn: bool
+) -> Tuple[Optional[dict], Optional[Path]]:
+    """
+    Run the short preparation steps concurrently before the main encode.
+    Returns the clip probe and the subtitles path to burn in (or None): the converted ASS file,
+    or the SRT itself, for the subtitles= filter, when it cannot be converted.
+    """
+    with ThreadPoolExecutor(max_workers=3) as ex:
+        # Warm the encoder probes (throwaway ffmpeg runs) while the clip is probed and subtitles are converted
+        ex.submit(_detect_nvenc)
+        ex.submit(_audio_encoder_args)
+        probe_future = ex.submit(_probe_clip, clip_path)
+        ass_future = None
+        if srt_path and srt_path.exists() and not no_burn:
+            # Convert subtitles to ASS once so libass does not re-parse the SRT on every run
+            ass_future = ex.submit(_srt_to_ass, srt_path, out_path.parent / f".{out_path.stem}.ass")
+        
+        clip_info = probe_future.result()
+        if ass_future is None:
+            return clip_info, None
+        try:
+            return clip_info, ass_future.result()
+        except (ValueError, UnicodeDecodeError, OSError) as e:
+            print(f"Warning: Could not convert {srt_path} to ASS ({e}), burning it in with the subtitles filter")
+            return clip_info, srt_path
+
+
+def _probe_clip(clip_path: Path) -> Optional[dict]:
+    """Return codec, dimensions and frame rate of the clip's video stream, or None if it cannot be probed."""
+    cmd = [
+        "ffprobe", "-v", "quiet", "-print_format", "json", "-select_streams", "v:0",
+        "-show_entries", f"stream={CLIP_PROBE_FIELDS}", str(clip_path)
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        stream = json.loads(result.stdout)["streams"][0]
+        num, _, den = stream["r_frame_rate"].partition("/")
+        return {
+            "codec": stream.get("codec_name"),
+            "width": int(stream["width"]),
+            "height": int(stream["height"]),
+            "fps": float(num) / float(den or 1),
+            "pix_fmt": stream.get("pix_fmt"),
+        }
+    except (FileNotFoundError, subprocess.CalledProcessError, ValueError, KeyError, IndexError, ZeroDivisionError):
+        return None
+
+
+def _matches_target(clip_info: Optional[dict]) -> bool:
+    """Check whether a probed clip is already H.264 at the output size and frame rate."""
+    return bool(
+        clip_info
+        and clip_info["codec"] == "h264"
+        and clip_info["width"] == TARGET_WIDTH
+        and clip_info["height"] == TARGET_HEIGHT
+        and abs(clip_info["fps"] - TARGET_FPS) < 0.01
+        and clip_info.get("pix_fmt") == "yuv420p"
+    )
+
+
+def _srt_to_ass(
+    srt_path: Path,
+    ass_path: Path,
+    font: str = ASS_FONT,
+    size: int = ASS_FONT_SIZE,
+    margin: int = ASS_MARGIN,
+    outline: int = ASS_OUTLINE
+) -> Path:
+    """
+    Write srt_path as an ASS file with the burn-in style baked in at the output resolution.
+    The file is reused while it is newer than the SRT and was written with the same style.
+    """
+    header = ASS_HEADER.format(font=font, size=size, margin=margin, outline=outline)
+    try:
+        if ass_path.stat().st_mtime >= srt_path.stat().st_mtime:
+            with open(ass_path, encoding='utf-8') as f:
+                if f.read(len(header)) == header:
+                    return ass_path
+    except FileNotFoundError:
+        pass
+    
+    events = []
+    content = srt_path.read_text(encoding='utf-8').replace('\r\n', '\n')
+    for block in content.strip().split('\n\n'):
+        lines = block.strip().split('\n')
+        # Skip the sequence number; the timing line is the one with an arrow
+        for i, line in enumerate(lines):
+            if '-->' in line:
+                start, _, end = line.partition('-->')
+                text = '\\N'.join(_srt_text_to_ass(line) for line in lines[i + 1:])
+                events.append(
+                    f"Dialogue: 0,{_ass_time(start)},{_ass_time(end)},Default,,0,0,0,,{text}\n"
+                )
+                break
+    
+    ass_path.parent.mkdir(parents=True, exist_ok=True)
+    ass_path.write_text(header + "".join(events), encoding='utf-8')
+    return ass_path
+
+
+def _srt_text_to_ass(text: str) -> str:
+    """
+    Convert one line of SRT text to ASS event text.
+    Braces and backslashes are escaped so they are not read as overrides; <i>, <b>, <u>, <s> and
+    <font color> become the matching override tags.
+    """
+    # A word joiner after the backslash keeps \N, \h etc. in the text from turning into line breaks
+    text = text.replace("\\", "\\\u2060").replace("{", "\\{").replace("}", "\\}")
+    return _SRT_TAG_RE.sub(_srt_tag_to_ass, text)
+
+
+def _srt_tag_to_ass(match: re.Match) -> str:
+    """Return the ASS override for one SRT markup tag."""
+    closing, style, font_attrs = match.groups()
+    if style:
+        return f"{{\\{style.lower()}{0 if closing else 1}}}"
+    if font_attrs is None:
+        # </font>: back to the style colour
+        return "{\\c}"
+    color = _FONT_COLOR_RE.search(font_attrs)
+    if not color:
+        return ""
+    # ASS colours are &HBBGGRR&
+    rgb = color.group(1).upper()
+    return f"{{\\c&H{rgb[4:6]}{rgb[2:4]}{rgb[0:2]}&}}"
+
+
+def _ass_time(srt_time: str) -> str:
+    """Convert an SRT timestamp (HH:MM:SS,mmm) to ASS (H:MM:SS.cc)."""
+    hms, _, ms = srt_time.strip().partition(',')
+    hours, minutes, seconds = hms.split(':')
+    return f"{int(hours)}:{minutes}:{seconds}.{int(ms or 0) // 10:02d}"
+
+
+@functools.lru_cache(maxsize=None)
+def _global_args() -> tuple:
+    """Return the leading ffmpeg arguments shared by every composition."""
+    # Let ffmpeg use every core for filter graph evaluation; decoders and encoders already default to
+    # automatic threading, and an explicit cap goes on each output (see threads in _composition_args)
+    filter_threads = str(os.cpu_count() or 4)
+    return (
+        # Only genuine errors reach stderr; per-frame stats would otherwise pile up in the pipe
+        "ffmpeg", "-y", "-nostats", "-loglevel", "error",
+        "-filter_threads", filter_threads,
+        "-filter_complex_threads", filter_threads,
+    )
+
+
+@functools.lru_cache(maxsize=64)
+def _video_encoder_args(preset: str, crf: int, use_nvenc: bool) -> tuple:
+    """Return the H.264 encoder arguments for the software or NVENC path (cached per style)."""
+    if use_nvenc:
+        # NVENC ignores -crf; -cq with -b:v 0 is its constant-quality equivalent
+        return (
+            "-c:v", "h264_nvenc", "-preset", NVENC_PRESETS.get(preset, "p4"),
+            "-tune", "hq", "-rc", "vbr", "-cq", str(crf), "-b:v", "0",
+            "-profile:v", "high",
+        )
+    return ("-c:v", "libx264", "-preset", preset, "-crf", str(crf))
+
+
+@functools.lru_cache(maxsize=None)
+def _audio_encoder_args() -> tuple:
+    """Return AAC encoder arguments, preferring libfdk_aac VBR when ffmpeg was built with it."""
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            capture_output=True, text=True, check=True
+        )
+        if "libfdk_aac" in result.stdout:
+            return ("-c:a", "libfdk_aac", "-vbr", "4")
+    except (FileNotFoundError, subprocess.CalledProcessError):
+        pass
+    return ("-c:a", "aac", "-q:a", "2")
+
+
+@functools.lru_cache(maxsize=None)
+def _detect_nvenc() -> bool:
+    """
+    Check once whether h264_nvenc is usable on this machine.
+    Static ffmpeg builds list nvenc even without a GPU, so encode a few blank frames instead of grepping -encoders.
+    """
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", "color=black:size=256x256:duration=0.1",
+        "-c:v", "h264_nvenc", "-f", "null", "-"
+    ]
+    try:
+        subprocess.run(cmd, check=True, capture_output=True)
+        return True
+    except (FileNotFoundError, subprocess.CalledProcessError):
+        return False
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Compose final short with video, voice, music, and subtitles")
-    parser.add_argument("--clip", required=True, type=Path, help="Input video clip")
-    parser.add_argument("--out", required=True, type=Path, help="Output video file")
+    parser.add_argument("--clip", type=Path, help="Input video clip")
+    parser.add_argument("--out", type=Path, help="Output video file")
+    parser.add_argument("--batch", type=Path, help="JSON list of jobs ({clip, out, voice, music, srt, no_burn}) composed in shared ffmpeg runs")
+    parser.add_argument("--batch-size", type=int, help=f"Jobs per shared ffmpeg run (default {BATCH_SIZE}, {NVENC_MAX_SESSIONS} on NVENC)")
     parser.add_argument("--voice", type=Path, help="Voice audio file")
     parser.add_argument("--music", type=Path, help="Background music file")
     parser.add_argument("--srt", type=Path, help="Subtitles file")
     parser.add_argument("--no-burn", action="store_true", help="Skip burning subtitles into video")
+    parser.add_argument("--preset", default="faster", help="x264 encoder preset (mapped to the nearest NVENC preset on GPU)")
+    parser.add_argument("--threads", type=int, default=0, help="Encoder threads per composition (0 = ffmpeg default)")
+    parser.add_argument("--target-lufs", type=float, default=TARGET_LUFS, help="Integrated loudness of the voice/music mix")
+    parser.add_argument("--no-loudnorm", action="store_true", help="Do not loudness-normalize the voice/music mix")
     parser.add_argument("--dry-run", action="store_true", help="Show what would be created without actually creating files")
     parser.add_argument("--json", action="store_true", help="Output machine-readable JSON summary")
+    parser.add_argument("--quiet", action="store_true", help="Do not print encoding progress")
     args = parser.parse_args()
     
+    target_lufs = None if args.no_loudnorm else args.target_lufs
+    
+    if args.batch:
+        with open(args.batch, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        jobs = [
+            {
+                "clip_path": Path(entry["clip"]),
+                "out_path": Path(entry["out"]),
+                "voice_path": Path(entry["voice"]) if entry.get("voice") else None,
+                "music_path": Path(entry["music"]) if entry.get("music") else None,
+                "srt_path": Path(entry["srt"]) if entry.get("srt") else None,
+                "no_burn": entry.get("no_burn", args.no_burn),
+            }
+            for entry in entries
+        ]
+        run_batch(
+            jobs, args.preset, args.quiet, batch_size=args.batch_size,
+            threads=args.threads, target_lufs=target_lufs, dry_run=args.dry_run, json_output=args.json
+        )
+        return
+    
+    if not args.clip or not args.out:
+        parser.error("--clip and --out are required unless --batch is given")
+    
     run(
         args.clip, args.out, args.voice, args.music, args.srt,
-        args.no_burn, args.dry_run, args.json
+        args.no_burn, args.dry_run, args.json, args.preset, args.quiet, args.threads, target_lufs
     )
 
 
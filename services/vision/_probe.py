@@ -0,0 +1,42 @@
+import functools
+import os
+import subprocess
+from pathlib import Path
+from typing import Union
+
+from utils import loads_json
+
+
+def probe(path: Union[str, Path]) -> dict:
+    """
+    Return ffprobe format and stream info for a media file.
+    Results are cached while the file's mtime and size are unchanged; treat the returned dict as read-only.
+    """
+    path_str = str(path)
+    try:
+        st = os.stat(path_str)
+    except OSError:
+        # Nothing stable to key on, let ffprobe report the error
+        return _run_ffprobe(path_str)
+    return _probe_cached(path_str, st.st_mtime_ns, st.st_size)
+
+
+def probe_duration_seconds(path: Union[str, Path]) -> float:
+    """Get container duration in seconds; raises KeyError/ValueError if ffprobe has none."""
+    return float(probe(path)["format"]["duration"])
+
+
+@functools.lru_cache(maxsize=512)
+def _probe_cached(path_str: str, mtime_ns: int, size: int) -> dict:
+    """Probe once per (path, mtime, size); failures raise and are not cached."""
+    return _run_ffprobe(path_str)
+
+
+def _run_ffprobe(path_str: str) -> dict:
+    """Run a single ffprobe call for format and streams."""
+    cmd = [
+        "ffprobe", "-v", "error", "-print_format", "json",
+        "-show_format", "-show_streams", path_str
+    ]
+    result = subprocess.run(cmd, capture_output=True, check=True)
+    return loads_json(result.stdout)
@@ -1,5 +1,8 @@
 from pathlib import Path
 from typing import List, Tuple
+from operator import itemgetter
+import heapq
+import random
 import subprocess
 import json
 
@@ -7,6 +10,9 @@ import json
 Segment = Tuple[float, float]
 Scored = Tuple[float, float, float] # start, end, score
 
+# Shared generator for score jitter; seed it for reproducible selections
+_RNG = random.Random()
+
 
 def select_top_segments(input_path: Path, scenes: List[Segment], *, min_s: int, max_s: int, top_k: int) -> List[Scored]:
     """
@@ -16,27 +22,27 @@ def select_top_segments(input_path: Path, scenes: List[Segment], *, min_s: int,
     candidates: List[Scored] = _slice_into_windows(scenes, min_s, max_s)
     # TODO: compute real scores; currently uniform
     scored = [(s, e, _score_window(input_path, s, e)) for s, e, _ in candidates]
-    scored.sort(key=lambda x: x[2], reverse=True)
-    return scored[:top_k]
+    # Partial selection instead of sorting every candidate; same order as a stable descending sort
+    return heapq.nlargest(top_k, scored, key=itemgetter(2))
 
 
 def _slice_into_windows(scenes: List[Segment], min_s: int, max_s: int) -> List[Scored]:
     """Generate windows of size between min_s and max_s with stride."""
     out: List[Scored] = []
+    # 50% overlap; at least 1s so tiny min_s values cannot stall
+    stride = max(1, min_s // 2)
+    
     for start, end in scenes:
         length = end - start
-        if length <= 0:
+        if length < min_s:
             continue
         
-        # Generate multiple windows with stride
-        stride = min_s // 2  # 50% overlap
-        current_start = start
-        
-        while current_start + min_s <= end:
+        # Window k starts at start + k * stride while a min_s window still fits in the scene
+        count = int((length - min_s) // stride) + 1
+        for current_start in (start + k * stride for k in range(count)):
             window_end = min(current_start + max_s, end)
             if window_end - current_start >= min_s:
                 out.append((current_start, window_end, 0.0))
-            current_start += stride
     
     return out
 
@@ -51,7 +57,4 @@ def _score_window(input_path: Path, start: float, end: float) -> float:
     base_score = duration * 0.1
     
     # Add some variation to avoid identical scores
-    import random
-    variation = random.uniform(0.8, 1.2)
-    
-    return base_score * variation
\ No newline at end of file
+    return base_score * _RNG.uniform(0.8, 1.2)
\ No newline at end of file
@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 import argparse
-import json
 import time
 from pathlib import Path
+from typing import Optional
 import sys
 import os
 
@@ -12,10 +12,21 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from scene_detector import detect_scenes
 from clip_selector import select_top_segments
 from vertical_crop import export_vertical_clips
-from utils import ensure_dir
+from utils import dumps_json, ensure_dir
 
 
-def run(input_path: Path, out_dir: Path, min_s: int, max_s: int, top_k: int, dry_run: bool = False, json_output: bool = False) -> None:
+def run(
+    input_path: Path,
+    out_dir: Path,
+    min_s: int,
+    max_s: int,
+    top_k: int,
+    dry_run: bool = False,
+    json_output: bool = False,
+    parallel: Optional[int] = None,
+    threads: Optional[int] = None,
+    fallback_chunk_s: float = 30.0
+) -> None:
     """Ingest a long video and export vertical clips."""
     start_time = time.time()
     
@@ -31,7 +42,7 @@ def run(input_path: Path, out_dir: Path, min_s: int, max_s: int, top_k: int, dry
     
     # Detect scenes
     print("Detecting scenes...")
-    scenes = detect_scenes(input_path)
+    scenes = detect_scenes(input_path, fallback_chunk_s, min_s=min_s, max_s=max_s)
     print(f"Found {len(scenes)} scenes")
     
     # Select top segments
@@ -47,7 +58,7 @@ def run(input_path: Path, out_dir: Path, min_s: int, max_s: int, top_k: int, dry
     
     # Export vertical clips
     print("Exporting vertical clips...")
-    output_files = export_vertical_clips(input_path, segments, out_dir)
+    output_files = export_vertical_clips(input_path, segments, out_dir, parallel=parallel, threads=threads)
     
     elapsed = time.time() - start_time
     print(f"Completed in {elapsed:.1f}s")
@@ -68,7 +79,7 @@ def run(input_path: Path, out_dir: Path, min_s: int, max_s: int, top_k: int, dry
             ],
             "elapsed_sec": elapsed
         }
-        print(json.dumps(result, indent=2))
+        print(dumps_json(result))
 
 
 def main() -> None:
@@ -78,11 +89,17 @@ def main() -> None:
     parser.add_argument("--min", dest="min_s", default=12, type=int, help="Minimum clip duration (seconds)")
     parser.add_argument("--max", dest="max_s", default=45, type=int, help="Maximum clip duration (seconds)")
     parser.add_argument("--top", dest="top_k", default=10, type=int, help="Number of top clips to select")
+    parser.add_argument("--parallel", type=int, help="Number of concurrent ffmpeg export processes (default: half the CPU cores)")
+    parser.add_argument("--threads", type=int, help="Threads per ffmpeg export process (default: cores / parallel)")
+    parser.add_argument("--fallback-chunks", type=float, default=30.0, help="Scene length (seconds) used when PySceneDetect is unavailable or finds no cuts")
     parser.add_argument("--dry-run", action="store_true", help="Show what would be created without actually creating files")
     parser.add_argument("--json", action="store_true", help="Output machine-readable JSON summary")
     args = parser.parse_args()
     
-    run(args.input, args.out, args.min_s, args.max_s, args.top_k, args.dry_run, args.json)
+    run(
+        args.input, args.out, args.min_s, args.max_s, args.top_k,
+        args.dry_run, args.json, args.parallel, args.threads, args.fallback_chunks
+    )
 
 
 if __name__ == "__main__":
@@ -1,44 +1,83 @@
+import math
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import subprocess
-import json
 
+from _probe import probe_duration_seconds
 
-# Optional: import scenedetect or OpenCV-based histogram diffs
-# import cv2
+
+# Optional: PySceneDetect's content detector (HSV histogram diffs in OpenCV)
+try:
+    from scenedetect import ContentDetector, detect
+except ImportError:
+    detect = None
+
+# ContentDetector's default cut threshold
+CONTENT_THRESHOLD = 27.0
 
 
 Segment = Tuple[float, float] # (start_sec, end_sec)
 
 
-def detect_scenes(input_path: Path) -> List[Segment]:
+def detect_scenes(
+    input_path: Path,
+    fallback_chunk_s: float = 30.0,
+    min_s: Optional[float] = None,
+    max_s: Optional[float] = None
+) -> List[Segment]:
     """
-    Returns a coarse list of scene segments (start_sec, end_sec).
-    TODO: Replace stub heuristic with PySceneDetect or histogram diff on frames.
+    Returns a list of scene segments (start_sec, end_sec).
+    Uses PySceneDetect when installed; otherwise, or when it finds no cuts, splits into fallback_chunk_s chunks.
+    With min_s, fast-cut footage whose scenes are all shorter than min_s has adjacent scenes merged
+    (up to max_s), and falls back to the chunks if that still gives no scene long enough for a clip.
     """
-    duration = _probe_duration_seconds(input_path)
+    if detect is not None:
+        try:
+            scene_list = detect(str(input_path), ContentDetector(threshold=CONTENT_THRESHOLD))
+        except Exception as e:
+            print(f"Warning: Scene detection failed ({e}), using {fallback_chunk_s:g}s chunks")
+            scene_list = []
+        if scene_list:
+            scenes = [(start.get_seconds(), end.get_seconds()) for start, end in scene_list]
+            if min_s is None or _has_scene_of(scenes, min_s):
+                return scenes
+            scenes = _merge_short_scenes(scenes, min_s, max_s or math.inf)
+            if _has_scene_of(scenes, min_s):
+                return scenes
+            print(f"Warning: No scene reaches {min_s:g}s, using {fallback_chunk_s:g}s chunks")
     
-    # Simple heuristic: split video into 30-second segments
-    # TODO: implement real scene detection with PySceneDetect
-    segments = []
-    segment_duration = 30.0
-    
-    for start in range(0, int(duration), int(segment_duration)):
-        end = min(start + segment_duration, duration)
-        segments.append((float(start), float(end)))
+    duration = _probe_duration_seconds(input_path)
     
-    return segments
+    # Simple heuristic: split video into fixed-size segments
+    chunk = max(1.0, float(fallback_chunk_s))
+    return [
+        (i * chunk, min((i + 1) * chunk, duration))
+        for i in range(math.ceil(duration / chunk))
+    ]
+
+
+def _has_scene_of(scenes: List[Segment], min_s: float) -> bool:
+    """Check that at least one scene is long enough to hold a min_s clip."""
+    return any(end - start >= min_s for start, end in scenes)
+
+
+def _merge_short_scenes(scenes: List[Segment], min_s: float, max_s: float) -> List[Segment]:
+    """Join consecutive scenes into spans of at most max_s, closing each span once it reaches min_s."""
+    merged = []
+    start, end = scenes[0]
+    for next_start, next_end in scenes[1:]:
+        if end - start >= min_s or next_end - start > max_s:
+            merged.append((start, end))
+            start = next_start
+        end = next_end
+    merged.append((start, end))
+    return merged
 
 
 def _probe_duration_seconds(input_path: Path) -> float:
     """Get video duration using ffprobe."""
     try:
-        cmd = [
-            "ffprobe", "-v", "error", "-show_entries", "format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1", str(input_path)
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return float(result.stdout.strip())
-    except (subprocess.CalledProcessError, ValueError, FileNotFoundError):
+        return probe_duration_seconds(input_path)
+    except (subprocess.CalledProcessError, ValueError, KeyError, FileNotFoundError):
         print("Warning: Could not probe video duration, assuming 600 seconds")
         return 600.0
\ No newline at end of file
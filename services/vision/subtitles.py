@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 import argparse
+import re
 import subprocess
+from itertools import accumulate
 from pathlib import Path
 from typing import Literal, Optional
 
+from _probe import probe_duration_seconds
+
 
 Mode = Literal["from-audio", "from-text"]
 
+# A sentence runs up to its . ! or ? (kept) or a line break; a dot before a digit (3.5) does not end it
+_SENT_RE = re.compile(r'[^.!?\s](?:[^.!?\n]|\.(?=\d))*[.!?]*')
+
 
 def generate_srt(clip_path: Path, srt_path: Path, mode: Mode, text: Optional[str] = None) -> None:
     """
@@ -41,33 +48,31 @@ def generate_from_audio(clip_path: Path, srt_path: Path) -> None:
 
 
 def generate_from_text(text: str, duration: float, srt_path: Path) -> None:
-    """Generate subtitles from text with linear timing."""
-    sentences = [s.strip() for s in text.split('.') if s.strip()]
+    """Generate subtitles from text, giving each sentence screen time proportional to its length."""
+    sentences = [m.group().rstrip() for m in _SENT_RE.finditer(text)]
     if not sentences:
         return
     
-    time_per_sentence = duration / len(sentences)
+    # Running character counts place each sentence's end as a fraction of the duration
+    cumulative = list(accumulate(len(s) for s in sentences))
+    total = cumulative[-1]
+    
+    parts = []
+    start_time = 0.0
+    for i, (sentence, chars) in enumerate(zip(sentences, cumulative), start=1):
+        end_time = duration * chars / total
+        parts.append(f"{i}\n{format_srt_time(start_time)} --> {format_srt_time(end_time)}\n{sentence}\n\n")
+        start_time = end_time
     
     with open(srt_path, 'w', encoding='utf-8') as f:
-        for i, sentence in enumerate(sentences):
-            start_time = i * time_per_sentence
-            end_time = min((i + 1) * time_per_sentence, duration)
-            
-            f.write(f"{i + 1}\n")
-            f.write(f"{format_srt_time(start_time)} --> {format_srt_time(end_time)}\n")
-            f.write(f"{sentence}\n\n")
+        f.write("".join(parts))
 
 
 def get_video_duration(video_path: Path) -> float:
     """Get video duration using ffprobe."""
     try:
-        cmd = [
-            "ffprobe", "-v", "error", "-show_entries", "format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1", str(video_path)
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return float(result.stdout.strip())
-    except (subprocess.CalledProcessError, ValueError, FileNotFoundError):
+        return probe_duration_seconds(video_path)
+    except (subprocess.CalledProcessError, ValueError, KeyError, FileNotFoundError):
         print("Warning: Could not probe video duration, assuming 30 seconds")
         return 30.0
 
@@ -82,10 +87,10 @@ def create_placeholder_srt(srt_path: Path) -> None:
 
 def format_srt_time(seconds: float) -> str:
     """Format seconds as SRT timestamp."""
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    secs = int(seconds % 60)
-    ms = int((seconds % 1) * 1000)
+    # Work in whole milliseconds so float remainders cannot turn x.001 into x.000
+    hours, rest = divmod(round(seconds * 1000), 3_600_000)
+    minutes, rest = divmod(rest, 60_000)
+    secs, ms = divmod(rest, 1000)
     
     return f"{hours:02d}:{minutes:02d}:{secs:02d},{ms:03d}"
 
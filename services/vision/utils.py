@@ -1,5 +1,38 @@
 from pathlib import Path
+import json
+
+try:
+    import orjson
+except ImportError:
+    # Optional C encoder; the stdlib json module is the fallback
+    orjson = None
 
 
 def ensure_dir(path: Path) -> None:
-    path.mkdir(parents=True, exist_ok=True)
\ No newline at end of file
+    path.mkdir(parents=True, exist_ok=True)
+
+
+def part_path(path: Path) -> Path:
+    """
+    Return the temporary path an encode writes to before it is renamed to path.
+    The .part suffix keeps half-written files out of *.mp4 listings, so ffmpeg needs -f to pick the muxer.
+    """
+    return path.with_name(f"{path.name}.part")
+
+
+def dumps_json(obj) -> str:
+    """
+    Serialize obj as 2-space indented JSON, using orjson when it is installed.
+    Both encoders accept non-str dict keys and keep non-ASCII characters as-is rather than as \\uXXXX escapes.
+    The text is not byte-identical: orjson writes some floats differently (1e-7 where json writes 1e-07).
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, indent=2, ensure_ascii=False)
+
+
+def loads_json(data):
+    """Parse JSON text or bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
\ No newline at end of file
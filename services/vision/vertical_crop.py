@@ -1,56 +1,270 @@
+from concurrent.futures import ThreadPoolExecutor
+import functools
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+import os
 import subprocess
 
+from _probe import probe
+from utils import part_path
+
 
 Scored = Tuple[float, float, float]
+Export = Tuple[Path, float, float] # dst, start, end
+
+# TODO: auto tracking crop using vidstab/subject tracking; start with center crop
+# Center crop to 1080x1920, then scale/pad if needed; assumes input >= 1080x1920 after scale
+# Used as is when the input dimensions cannot be probed, see _filter_chain_for
+FILTER_CHAIN = (
+    "scale=-2:1920,"
+    "crop=1080:1920,"
+    "fps=30"
+)
 
+# Hardware H.264 encoders tried in order before falling back to libx264
+HW_ENCODERS = (
+    ("h264_nvenc", (
+        "-preset", "p4", "-tune", "hq", "-rc", "vbr", "-cq", "20", "-b:v", "0", "-bf", "2", "-pix_fmt", "nv12"
+    )),
+    ("h264_qsv", ("-preset", "medium", "-global_quality", "20", "-pix_fmt", "nv12")),
+)
+# Codecs and surface formats NVDEC decodes straight into CUDA frames for scale_cuda
+CUDA_DECODE_CODECS = {"h264", "hevc", "vp9", "av1"}
+CUDA_DECODE_PIX_FMTS = {"yuv420p", "yuvj420p", "yuv420p10le"}
+# fastdecode keeps these intermediates cheap to decode again in the montage step
+SOFTWARE_ENCODER = (
+    "-c:v", "libx264", "-preset", "veryfast", "-tune", "fastdecode", "-crf", "20", "-pix_fmt", "yuv420p"
+)
 
-def export_vertical_clips(input_path: Path, segments: List[Scored], out_dir: Path) -> List[Path]:
-    """Export vertical clips and return list of output files."""
+
+def export_vertical_clips(
+    input_path: Path,
+    segments: List[Scored],
+    out_dir: Path,
+    parallel: Optional[int] = None,
+    threads: Optional[int] = None
+) -> List[Path]:
+    """
+    Export vertical clips and return list of output files.
+    Clips are spread over `parallel` concurrent ffmpeg processes (default: half the cores), each limited
+    to `threads` threads (default: cores / parallel) so the encoders do not oversubscribe the CPU.
+    """
     out_dir.mkdir(parents=True, exist_ok=True)
-    output_files = []
+    exports: List[Export] = [
+        (out_dir / f"clip{idx:02d}.mp4", start, end)
+        for idx, (start, end, score) in enumerate(segments, start=1)
+    ]
     
-    for idx, (start, end, score) in enumerate(segments, start=1):
-        out_path = out_dir / f"clip{idx:02d}.mp4"
-        _ffmpeg_export_9x16(input_path, out_path, start, end)
-        output_files.append(out_path)
+    if not exports:
+        return []
     
-    return output_files
+    cores = os.cpu_count() or 2
+    workers = max(1, min(parallel or cores // 2, len(exports)))
+    threads = threads or max(2, cores // workers)
+    
+    encoder_args = _select_h264_encoder()
+    video = _probe_video(input_path)
+    # With NVENC, decode and scale on the GPU; only the cheap crop runs on downloaded frames
+    cuda = encoder_args[1] == "h264_nvenc" and _cuda_decodable(video) and _has_cuda_scaler()
+    filter_chain = _filter_chain_for(video, cuda)
+    software_chain = _filter_chain_for(video)
+    
+    # Deal clips round-robin so every process gets a similar share of the video
+    groups = [exports[i::workers] for i in range(workers)]
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        list(ex.map(
+            lambda group: _ffmpeg_export_9x16(
+                input_path, group, threads, encoder_args, filter_chain, cuda, software_chain
+            ),
+            groups
+        ))
+    
+    return [dst for dst, _, _ in exports]
 
 
-def _ffmpeg_export_9x16(src: Path, dst: Path, start: float, end: float) -> None:
-    """Export a 9:16 vertical clip using ffmpeg."""
-    duration = max(0.1, end - start)
+def _build_export_command(
+    src: Path,
+    exports: List[Export],
+    threads: int = 0,
+    encoder_args: Tuple[str, ...] = SOFTWARE_ENCODER,
+    filter_chain: str = FILTER_CHAIN,
+    cuda: bool = False
+) -> list:
+    """
+    Build one ffmpeg command writing every clip.
+    Each segment is its own input with -ss/-t before -i, so ffmpeg seeks in the demuxer and only decodes that range.
+    cuda decodes every input to CUDA frames, for filter chains built with _vertical_filter_chain(..., cuda=True).
+    """
+    # Only errors go to stderr, so the captured output stays small on long sources
+    cmd = ["ffmpeg", "-y", "-nostats", "-loglevel", "error"]
     
-    # TODO: auto tracking crop using vidstab/subject tracking; start with center crop
-    # Center crop to 1080x1920, then scale/pad if needed; assumes input >= 1080x1920 after scale
-    filter_chain = (
-        "scale=-2:1920,"
-        "crop=1080:1920,"
-        "fps=30"
-    )
+    for _, start, end in exports:
+        duration = max(0.1, end - start)
+        if cuda:
+            cmd.extend(["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"])
+        cmd.extend(["-threads", str(threads), "-ss", str(start), "-t", str(duration), "-i", str(src)])
     
+    graph = ";".join(f"[{i}:v]{filter_chain}[v{i}]" for i in range(len(exports)))
+    cmd.extend(["-filter_complex", graph])
+    
+    for i, (dst, _, _) in enumerate(exports):
+        cmd.extend([
+            "-map", f"[v{i}]", "-map", f"{i}:a?",
+            *encoder_args,
+            "-c:a", "aac", "-b:a", "192k",
+            "-threads", str(threads),
+            "-movflags", "+faststart",
+            # Clips are staged under a .part name, so the muxer cannot be inferred
+            "-f", "mp4",
+            str(dst)
+        ])
+    
+    return cmd
+
+
+def _probe_video(input_path: Path) -> Optional[dict]:
+    """Return displayed width/height, rotation, codec and pix_fmt of the first video stream, or None if unknown."""
+    try:
+        stream = next(s for s in probe(input_path)["streams"] if s.get("codec_type") == "video")
+        width, height = int(stream["width"]), int(stream["height"])
+        
+        # Phone footage is often stored landscape with a rotation that ffmpeg applies on decode
+        rotation = stream.get("tags", {}).get("rotate") or next(
+            (d.get("rotation") for d in stream.get("side_data_list", []) if "rotation" in d), 0
+        )
+        rotation = int(float(rotation))
+        if rotation % 180:
+            width, height = height, width
+    except (subprocess.CalledProcessError, FileNotFoundError, StopIteration, KeyError, ValueError):
+        return None
+    
+    return {
+        "width": width,
+        "height": height,
+        "rotation": rotation % 360,
+        "codec": stream.get("codec_name"),
+        "pix_fmt": stream.get("pix_fmt"),
+    }
+
+
+def _filter_chain_for(video: Optional[dict], cuda: bool = False) -> str:
+    """Pick the 9:16 filter chain for the probed video, falling back to FILTER_CHAIN."""
+    if video is None:
+        return FILTER_CHAIN
+    return _vertical_filter_chain(video["width"], video["height"], cuda)
+
+
+def _vertical_filter_chain(width: int, height: int, cuda: bool = False) -> str:
+    """
+    Build a center-crop chain to 1080x1920 that only scales the pixels that are kept.
+    Wider than 9:16 crops first and scales the crop; taller scales to 1080 wide and trims the height.
+    With cuda the scale runs in scale_cuda on decoded CUDA frames, which are then downloaded for the crop.
+    """
+    if (width, height) == (1080, 1920):
+        return "fps=30"
+    wide = width * 16 > height * 9
+    if cuda:
+        scale = "-2:1920" if wide else "1080:-2"
+        return f"scale_cuda={scale}:format=nv12,hwdownload,format=nv12,crop=1080:1920,fps=30"
+    if wide:
+        return "crop=trunc(ih*9/32)*2:ih,scale=1080:1920,fps=30"
+    return "scale=1080:-2,crop=1080:1920,fps=30"
+
+
+def _cuda_decodable(video: Optional[dict]) -> bool:
+    """
+    Check that NVDEC can decode the video to CUDA frames and that there is something to scale.
+    Rotated sources stay on the CPU: ffmpeg does not autorotate hardware frames, so scale_cuda would get them sideways.
+    """
+    return bool(
+        video
+        and not video.get("rotation")
+        and video["codec"] in CUDA_DECODE_CODECS
+        and video["pix_fmt"] in CUDA_DECODE_PIX_FMTS
+        and (video["width"], video["height"]) != (1080, 1920)
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _has_cuda_scaler() -> bool:
+    """Check that this ffmpeg has scale_cuda and can open a CUDA device, by scaling a few blank frames."""
     cmd = [
-        "ffmpeg", "-y",
-        "-ss", str(start),
-        "-t", str(duration),
-        "-i", str(src),
-        "-vf", filter_chain,
-        "-c:v", "libx264", "-preset", "veryfast", "-crf", "20",
-        "-c:a", "aac", "-b:a", "192k",
-        str(dst)
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-init_hw_device", "cuda=gpu", "-filter_hw_device", "gpu",
+        "-f", "lavfi", "-i", "color=black:size=256x256:duration=0.1",
+        "-vf", "format=nv12,hwupload,scale_cuda=128:128:format=nv12,hwdownload,format=nv12",
+        "-f", "null", "-"
     ]
-    
     try:
         subprocess.run(cmd, check=True, capture_output=True)
+        return True
+    except (FileNotFoundError, subprocess.CalledProcessError):
+        return False
+
+
+@functools.lru_cache(maxsize=None)
+def _select_h264_encoder() -> Tuple[str, ...]:
+    """
+    Return encoder arguments for the first usable hardware H.264 encoder, else libx264.
+    Each candidate is tried on a few blank frames since ffmpeg builds list encoders the machine cannot run.
+    """
+    for name, options in HW_ENCODERS:
+        cmd = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", "color=black:size=256x256:duration=0.1",
+            "-c:v", name, "-pix_fmt", "nv12", "-f", "null", "-"
+        ]
+        try:
+            subprocess.run(cmd, check=True, capture_output=True)
+            return ("-c:v", name) + options
+        except (FileNotFoundError, subprocess.CalledProcessError):
+            continue
+    return SOFTWARE_ENCODER
+
+
+def _ffmpeg_export_9x16(
+    src: Path,
+    exports: List[Export],
+    threads: int = 0,
+    encoder_args: Tuple[str, ...] = SOFTWARE_ENCODER,
+    filter_chain: str = FILTER_CHAIN,
+    cuda: bool = False,
+    software_chain: str = FILTER_CHAIN
+) -> None:
+    """
+    Export 9:16 vertical clips using a single ffmpeg process.
+    Clips are written as .part files and renamed once ffmpeg succeeds, so readers never see a partial clip.
+    A failed CUDA run is retried once with software_chain on CPU frames before falling back to placeholders.
+    """
+    staged = [(part_path(dst), start, end) for dst, start, end in exports]
+    cmd = _build_export_command(src, staged, threads, encoder_args, filter_chain, cuda)
+    
+    try:
+        try:
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except subprocess.CalledProcessError:
+            if not cuda:
+                raise
+            print("Warning: CUDA export failed, retrying with the software filter chain")
+            for part, _, _ in staged:
+                part.unlink(missing_ok=True)
+            cmd = _build_export_command(src, staged, threads, encoder_args, software_chain)
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        for (dst, _, _), (part, _, _) in zip(exports, staged):
+            os.replace(part, dst)
     except (FileNotFoundError, subprocess.CalledProcessError) as e:
-        print(f"Warning: ffmpeg failed. Creating placeholder file: {dst}")
-        # Create a placeholder file for testing
-        dst.parent.mkdir(parents=True, exist_ok=True)
-        with open(dst, 'w') as f:
-            f.write(f"# Placeholder video file\n")
-            f.write(f"# Original: {src}\n")
-            f.write(f"# Start: {start}s, End: {end}s, Duration: {duration}s\n")
-            f.write(f"# Would be: 1080x1920 vertical video\n")
-            f.write(f"# Error: {e}\n")
\ No newline at end of file
+        for part, _, _ in staged:
+            part.unlink(missing_ok=True)
+        error = str(e)
+        if getattr(e, "stderr", None):
+            error += f"\n# ffmpeg: {e.stderr[-4096:].decode(errors='replace').strip()}"
+        for dst, start, end in exports:
+            print(f"Warning: ffmpeg failed. Creating placeholder file: {dst}")
+            # Create a placeholder file for testing
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            with open(dst, 'w') as f:
+                f.write(f"# Placeholder video file\n")
+                f.write(f"# Original: {src}\n")
+                f.write(f"# Start: {start}s, End: {end}s, Duration: {max(0.1, end - start)}s\n")
+                f.write(f"# Would be: 1080x1920 vertical video\n")
+                f.write(f"# Error: {error}\n")
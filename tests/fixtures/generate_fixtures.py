@@ -4,103 +4,190 @@ Generate test fixtures for the test suite.
 Creates small video clips, audio files, and SRT files for testing.
 """
 
+import argparse
+import functools
+import hashlib
+import math
 import os
 import subprocess
+import sys
 import tempfile
+import wave
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Tuple
 
 
-def create_test_video(output_path: Path, duration: int = 5, width: int = 1080, height: int = 1920):
-    """Create a test video file using ffmpeg."""
-    cmd = [
-        'ffmpeg', '-y',
-        '-f', 'lavfi',
-        '-i', f'testsrc2=duration={duration}:size={width}x{height}:rate=30',
-        '-f', 'lavfi',
-        '-i', f'sine=frequency=440:duration={duration}',
-        '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '23',
-        '-c:a', 'aac', '-b:a', '128k',
-        str(output_path)
-    ]
-    
+# The test clip only has to decode, so encode as cheaply as possible
+SOFTWARE_VIDEO_ARGS = (
+    '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency', '-threads', '0', '-crf', '30'
+)
+# Hardware H.264 encoders preferred over libx264 when this ffmpeg lists them, fastest settings first
+HW_VIDEO_ARGS = (
+    ('h264_nvenc', ('-c:v', 'h264_nvenc', '-preset', 'p1')),
+    ('h264_qsv', ('-c:v', 'h264_qsv', '-preset', 'veryfast', '-pix_fmt', 'nv12')),
+    ('h264_videotoolbox', ('-c:v', 'h264_videotoolbox')),
+)
+
+# Files written by main(), checked before skipping a run
+FIXTURE_FILES = ("test_clip.mp4", "test_music.mp3", "test_voice.wav", "test_subtitles.srt", "test_metadata.json")
+# Fixed fixture contents, encoded once; the SRT takes the clip duration in seconds
+SRT_TEMPLATE = b"""1
+00:00:00,000 --> 00:00:02,500
+This is a test subtitle
+
+2
+00:00:02,500 --> 00:00:%02d,000
+Second test subtitle line
+"""
+METADATA_JSON = """{
+  "title": "Test Diving Video",
+  "narration": "This is a test narration for our diving video. It contains exactly the right amount of words to test our pipeline. The narration describes underwater scenes with vibrant coral reefs and marine life swimming gracefully through crystal clear waters.",
+  "caption": "Experience the beauty of underwater exploration. Discover the serenity beneath the waves.",
+  "hashtags": ["#diving", "#ocean", "#underwater", "#test", "#meditation", "#nature", "#marine", "#serenity", "#peaceful", "#exploration", "#adventure", "#zen"]
+}""".encode('utf-8')
+
+
+@functools.lru_cache(maxsize=None)
+def select_video_args() -> Tuple[str, ...]:
+    """Return encoder arguments for the first hardware H.264 encoder in ffmpeg -encoders, else libx264."""
     try:
-        subprocess.run(cmd, check=True, capture_output=True)
-        print(f"✅ Created test video: {output_path}")
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Failed to create video: {e}")
-        raise
+        result = subprocess.run(
+            ['ffmpeg', '-hide_banner', '-encoders'], check=True, capture_output=True, text=True
+        )
+    except (FileNotFoundError, subprocess.CalledProcessError):
+        return SOFTWARE_VIDEO_ARGS
+    
+    available = {fields[1] for fields in map(str.split, result.stdout.splitlines()) if len(fields) > 1}
+    return next((args for name, args in HW_VIDEO_ARGS if name in available), SOFTWARE_VIDEO_ARGS)
 
 
-def create_test_audio(output_path: Path, duration: int = 5, sample_rate: int = 44100):
-    """Create a test audio file using ffmpeg."""
-    cmd = [
+def build_media_command(
+    clip_path: Path,
+    music_path: Path,
+    duration: int = 5,
+    music_duration: int = 3,
+    width: int = 1080,
+    height: int = 1920,
+    sample_rate: int = 44100,
+    video_args: Tuple[str, ...] = SOFTWARE_VIDEO_ARGS
+) -> list:
+    """Build one ffmpeg command rendering the test clip and music from lavfi sources."""
+    return [
         'ffmpeg', '-y',
-        '-f', 'lavfi',
-        '-i', f'sine=frequency=220:duration={duration}',
-        '-ar', str(sample_rate),
-        '-ac', '1',  # mono
-        str(output_path)
+        '-f', 'lavfi', '-i', f'testsrc2=duration={duration}:size={width}x{height}:rate=30',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=220:duration={music_duration}',
+        # Test video with a 440Hz tone
+        '-map', '0:v', '-map', '1:a',
+        *video_args, '-g', '30',
+        '-c:a', 'aac', '-b:a', '64k',
+        str(clip_path),
+        # Music, mono
+        '-map', '2:a', '-ar', str(sample_rate), '-ac', '1', str(music_path),
     ]
+
+
+def create_test_media(clip_path: Path, music_path: Path, duration: int = 5, music_duration: int = 3):
+    """Create the test video and the MP3 music with a single ffmpeg process, on a hardware encoder if listed."""
+    video_args = select_video_args()
+    cmd = build_media_command(clip_path, music_path, duration, music_duration, video_args=video_args)
     
     try:
-        subprocess.run(cmd, check=True, capture_output=True)
-        print(f"✅ Created test audio: {output_path}")
+        try:
+            subprocess.run(cmd, check=True, capture_output=True)
+        except subprocess.CalledProcessError:
+            if video_args == SOFTWARE_VIDEO_ARGS:
+                raise
+            # Listed encoders may still lack a device or driver on this machine
+            print(f"Warning: {video_args[1]} failed, retrying with libx264")
+            cmd = build_media_command(clip_path, music_path, duration, music_duration)
+            subprocess.run(cmd, check=True, capture_output=True)
+        print(f"✅ Created test video: {clip_path}")
+        print(f"✅ Created test audio: {music_path}")
     except subprocess.CalledProcessError as e:
-        print(f"❌ Failed to create audio: {e}")
+        print(f"❌ Failed to create media: {e}")
         raise
 
 
+def create_test_wav(output_path: Path, duration: int = 5, frequency: int = 220, sample_rate: int = 44100):
+    """Write a mono 16-bit sine WAV directly, without ffmpeg."""
+    # Same level as ffmpeg's sine source (amplitude 1/8)
+    amplitude = 32767 / 8
+    step = 2 * math.pi * frequency / sample_rate
+    samples = array('h', (round(amplitude * math.sin(step * n)) for n in range(duration * sample_rate)))
+    if sys.byteorder == 'big':
+        samples.byteswap()  # WAV data is little-endian
+    
+    with wave.open(str(output_path), 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(samples.tobytes())
+    print(f"✅ Created test audio: {output_path}")
+
+
 def create_test_srt(output_path: Path, duration: int = 5):
     """Create a test SRT subtitle file."""
-    content = f"""1
-00:00:00,000 --> 00:00:02,500
-This is a test subtitle
-
-2
-00:00:02,500 --> 00:00:{duration:02d},000
-Second test subtitle line
-"""
-    
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(content)
+    output_path.write_bytes(SRT_TEMPLATE % duration)
     print(f"✅ Created test SRT: {output_path}")
 
 
 def create_test_metadata(output_path: Path):
     """Create test metadata JSON."""
-    content = """{
-  "title": "Test Diving Video",
-  "narration": "This is a test narration for our diving video. It contains exactly the right amount of words to test our pipeline. The narration describes underwater scenes with vibrant coral reefs and marine life swimming gracefully through crystal clear waters.",
-  "caption": "Experience the beauty of underwater exploration. Discover the serenity beneath the waves.",
-  "hashtags": ["#diving", "#ocean", "#underwater", "#test", "#meditation", "#nature", "#marine", "#serenity", "#peaceful", "#exploration", "#adventure", "#zen"]
-}"""
-    
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(content)
+    output_path.write_bytes(METADATA_JSON)
     print(f"✅ Created test metadata: {output_path}")
 
 
+def fixtures_key() -> str:
+    """Hash this generator's source, which holds every fixture parameter."""
+    return hashlib.sha256(Path(__file__).read_bytes()).hexdigest()
+
+
 def main():
-    """Create all test fixtures."""
+    """Create all test fixtures, unless the stamp shows they came from this exact generator."""
+    parser = argparse.ArgumentParser(description="Generate test fixtures")
+    parser.add_argument("--force", action="store_true", help="Regenerate even if the fixtures are up to date")
+    args = parser.parse_args()
+    
     fixtures_dir = Path(__file__).parent
     fixtures_dir.mkdir(exist_ok=True)
     
-    print("🎬 Generating test fixtures...")
-    
-    # Create test video (5 seconds, vertical)
-    create_test_video(fixtures_dir / "test_clip.mp4", duration=5)
+    stamp_path = fixtures_dir / ".stamp"
+    key = fixtures_key()
+    up_to_date = (
+        stamp_path.exists() and stamp_path.read_text().strip() == key
+        and all((fixtures_dir / name).exists() for name in FIXTURE_FILES)
+    )
+    if up_to_date and not args.force:
+        print("✅ Test fixtures are up to date (use --force to regenerate)")
+        return
     
-    # Create test audio (5 seconds, mono, 44.1kHz)
-    create_test_audio(fixtures_dir / "test_voice.wav", duration=5)
-    
-    # Create test music (3 seconds for background)
-    create_test_audio(fixtures_dir / "test_music.mp3", duration=3)
+    # Drop the stamp first so a failed run is never mistaken for a complete one
+    stamp_path.unlink(missing_ok=True)
+    print("🎬 Generating test fixtures...")
     
-    # Create test subtitles
-    create_test_srt(fixtures_dir / "test_subtitles.srt", duration=5)
+    # Fixtures are independent files; the Python-side work overlaps the ffmpeg encode
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        futures = [
+            # Create test video (5 seconds, vertical) and music (3 seconds for background) in one ffmpeg run
+            ex.submit(
+                create_test_media, fixtures_dir / "test_clip.mp4", fixtures_dir / "test_music.mp3",
+                duration=5, music_duration=3
+            ),
+            # Create test audio (5 seconds, mono, 44.1kHz)
+            ex.submit(create_test_wav, fixtures_dir / "test_voice.wav", duration=5),
+            # Create test subtitles
+            ex.submit(create_test_srt, fixtures_dir / "test_subtitles.srt", duration=5),
+            # Create test metadata
+            ex.submit(create_test_metadata, fixtures_dir / "test_metadata.json"),
+        ]
+        # Re-raise the first failure
+        for future in futures:
+            future.result()
     
-    # Create test metadata
-    create_test_metadata(fixtures_dir / "test_metadata.json")
+    stamp_path.write_text(key + "\n")
     
     print("\n✅ All test fixtures created successfully!")
     print(f"📁 Location: {fixtures_dir}")
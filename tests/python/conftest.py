@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""Shared pytest fixtures."""
+import os
+import sys
+import tempfile
+
+import pytest
+
+
+# Tests only write tiny placeholder files, so keep tempfile and tmp_path in RAM when Linux offers it
+# An explicit TMPDIR still wins
+if sys.platform == "linux" and "TMPDIR" not in os.environ and os.access("/dev/shm", os.W_OK):
+    tempfile.tempdir = "/dev/shm"
+
+
+@pytest.fixture(scope="session")
+def shared_inputs(tmp_path_factory):
+    """Placeholder clip, voice, music and subtitle inputs written once for the whole session; treat them as read-only."""
+    inputs_dir = tmp_path_factory.mktemp("inputs")
+    inputs = {
+        "clip_path": inputs_dir / "clip.mp4",
+        "voice_path": inputs_dir / "voice.wav",
+        "music_path": inputs_dir / "music.mp3",
+        "srt_path": inputs_dir / "subs.srt",
+    }
+    inputs["clip_path"].write_text("dummy video content")
+    inputs["voice_path"].write_text("dummy voice content")
+    inputs["music_path"].write_text("dummy music content")
+    inputs["srt_path"].write_text("1\n00:00:00,000 --> 00:00:02,000\nHello\n", encoding='utf-8')
+    return inputs
+
+
+@pytest.fixture(scope="session")
+def read_head():
+    """Return a reader for the first bytes of a file, so output checks never load a whole video."""
+    def read(path, size=4096):
+        with open(path, 'rb') as f:
+            return f.read(size)
+    return read
@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""Test the auto edit ffmpeg command building."""
+import pytest
+import json
+from itertools import product
+from pathlib import Path
+import subprocess
+from unittest.mock import patch
+
+# Add the services directory to the path
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent.parent / "services" / "montage"))
+
+from auto_edit import (
+    main, run, run_batch, NVENC_MAX_SESSIONS, _build_ffmpeg_command, _build_batch_command, _check_filter_graph, _prepare_inputs, _probe_clip,
+    _srt_to_ass, _video_encoder_args
+)
+
+
+class TestBuildFfmpegCommand:
+    def test_software_encoder(self):
+        """Test libx264 output settings when NVENC is unavailable."""
+        with patch('auto_edit._detect_nvenc', return_value=False):
+            cmd = _build_ffmpeg_command(
+                Path("clip.mp4"), Path("out.mp4"), None, None, None, no_burn=True
+            )
+        
+        cmd_str = " ".join(cmd)
+        args = frozenset(cmd)
+        assert "-c:v libx264 -preset faster -crf 20" in cmd_str
+        assert "-hwaccel" not in args
+        # No thread cap: ffmpeg's automatic threading applies to every decoder and encoder
+        assert "-threads" not in args
+        assert cmd[cmd.index("-pix_fmt") + 1] == "yuv420p"
+        assert {"+faststart", "-filter_complex_threads"} <= args
+        assert cmd[-5:-1] == ["-ar", "44100", "-ac", "2"]
+        assert cmd[-1] == "out.mp4"
+    
+    def test_encoder_threads(self):
+        """Test that a thread cap is applied to the output encoder."""
+        with patch('auto_edit._detect_nvenc', return_value=False):
+            cmd = _build_ffmpeg_command(
+                Path("clip.mp4"), Path("out.mp4"), None, None, None, no_burn=True, threads=4
+            )
+        
+        # The last -threads belongs to the output, after the encoder selection
+        threads_at = len(cmd) - 1 - cmd[::-1].index("-threads")
+        assert cmd[threads_at + 1] == "4"
+        assert threads_at > cmd.index("libx264")
+    
+    def test_nvenc_encoder(self):
+        """Test NVENC output settings and GPU decode flags."""
+        with patch('auto_edit._detect_nvenc', return_value=True):
+            cmd = _build_ffmpeg_command(
+                Path("clip.mp4"), Path("out.mp4"), None, None, None, no_burn=True
+            )
+        
+        cmd_str = " ".join(cmd)
+        assert "-c:v h264_nvenc -preset p3" in cmd_str
+        assert "-cq 20 -b:v 0" in cmd_str
+        assert "-crf" not in frozenset(cmd)
+        assert "-hwaccel_output_format" in frozenset(cmd)
+        assert cmd.index("-hwaccel") < cmd.index("-i")
+    
+    def test_nvenc_keeps_frames_on_cpu_for_subtitles(self, tmp_path):
+        """Test that burning subtitles disables CUDA output frames."""
+        ass_path = tmp_path / "subs.ass"
+        ass_path.write_text("[Script Info]\n")
+        
+        with patch('auto_edit._detect_nvenc', return_value=True):
+            cmd = _build_ffmpeg_command(
+                Path("clip.mp4"), Path("out.mp4"), None, None, ass_path, no_burn=False
+            )
+        
+        args = frozenset(cmd)
+        assert "-hwaccel" in args
+        assert "-hwaccel_output_format" not in args
+        
+        graph = cmd[cmd.index("-filter_complex") + 1]
+        assert graph.startswith(f"[0:v]fps=30,ass={ass_path}")
+        assert graph.endswith("[vout]")
+        assert cmd[cmd.index("-map") + 1] == "[vout]"
+        assert args.isdisjoint({"-vf", "-af"})
+    
+    def test_subtitle_path_is_escaped(self, tmp_path):
+        """Test that filter graph special characters in the ASS path are escaped."""
+        ass_path = tmp_path / "it's, [a]:b.ass"
+        ass_path.write_text("[Script Info]\n")
+        
+        with patch('auto_edit._detect_nvenc', return_value=False):
+            cmd = _build_ffmpeg_command(
+                Path("clip.mp4"), Path("out.mp4"), None, None, ass_path, no_burn=False
+            )
+        
+        graph = cmd[cmd.index("-filter_complex") + 1]
+        assert rf"ass={tmp_path}/it\\\'s\, \[a\]\\:b.ass[vout]" in graph
+    
+    def test_stream_copy_when_clip_matches_target(self):
+        """Test that a conforming clip with nothing to mix is stream-copied."""
+        clip_info = {"codec": "h264", "width": 1080, "height": 1920, "fps": 30.0, "pix_fmt": "yuv420p"}
+        with patch('auto_edit._detect_nvenc', return_value=True):
+            cmd = _build_ffmpeg_command(
+                Path("clip.mp4"), Path("out.mp4"), None, None, None, no_burn=True, clip_info=clip_info
+            )
+        
+        assert cmd[-7:] == ["-movflags", "+faststart", "-f", "mp4", "-c", "copy", "out.mp4"]
+        assert frozenset(cmd).isdisjoint({"-filter_complex", "-hwaccel", "-r"})
+    
+    def test_reencode_when_clip_differs_from_target(self):
+        """Test that a non-conforming clip is re-encoded."""
+        clip_info = {"codec": "hevc", "width": 1080, "height": 1920, "fps": 30.0, "pix_fmt": "yuv420p"}
+        with patch('auto_edit._detect_nvenc', return_value=False):
+            cmd = _build_ffmpeg_command(
+                Path("clip.mp4"), Path("out.mp4"), None, None, None, no_burn=True, clip_info=clip_info
+            )
+        
+        args = frozenset(cmd)
+        assert "libx264" in args
+        assert args.isdisjoint({"copy", "-pix_fmt", "-r"})
+        assert not any("fps=" in arg for arg in args)
+        assert cmd[cmd.index("-map", cmd.index("-map") + 1) + 1] == "0:a?"
+    
+    def test_probe_clip_asks_only_for_read_fields(self):
+        """Test that the clip probe requests just the stream fields it parses."""
+        stdout = json.dumps({"streams": [
+            {"codec_name": "h264", "width": 1080, "height": 1920, "r_frame_rate": "30000/1001", "pix_fmt": "yuv420p"}
+        ]})
+        
+        with patch('subprocess.run') as mock_run:
+            mock_run.return_value.stdout = stdout
+            info = _probe_clip(Path("clip.mp4"))
+        
+        cmd = mock_run.call_args[0][0]
+        assert cmd[cmd.index("-show_entries") + 1] == "stream=codec_name,width,height,r_frame_rate,pix_fmt"
+        assert "-show_streams" not in cmd
+        assert info == {"codec": "h264", "width": 1080, "height": 1920, "fps": pytest.approx(29.97, abs=0.01), "pix_fmt": "yuv420p"}
+    
+    def test_batch_offsets_inputs_and_labels(self, tmp_path):
+        """Test that batched jobs address their own inputs and filter labels."""
+        voice_path = tmp_path / "voice.wav"
+        voice_path.write_text("voice")
+        jobs = [
+            {"clip_path": Path("a.mp4"), "out_path": Path("a_out.mp4"), "voice_path": voice_path},
+            {"clip_path": Path("b.mp4"), "out_path": Path("b_out.mp4"), "voice_path": voice_path},
+        ]
+        
+        with patch('auto_edit._detect_nvenc', return_value=False):
+            cmd = _build_batch_command(jobs, [(None, None), (None, None)], preset="faster")
+        
+        assert cmd.count("-i") == 4
+        assert cmd.count("-filter_complex") == 1
+        graph = cmd[cmd.index("-filter_complex") + 1]
+        assert "[0:v]fps=30[vout1]" in graph
+        assert "[2:v]fps=30[vout2]" in graph
+        assert "[3:a]volume=1.0,loudnorm=" in graph
+        assert graph.endswith("[final_audio2]")
+        assert cmd.index("a_out.mp4") < cmd.index("b_out.mp4") == len(cmd) - 1
+    
+    def test_filter_graph_check_rejects_miswired_pads(self):
+        """Test that dangling pads and missing inputs are caught before running ffmpeg."""
+        _check_filter_graph(["[1:a]volume=1.0[final_audio]"], 2, ["-map", "0:v", "-map", "[final_audio]"])
+        
+        with pytest.raises(ValueError, match="missing input"):
+            _check_filter_graph(["[2:a]volume=0.5[final_audio]"], 2, ["-map", "0:v", "-map", "[final_audio]"])
+        with pytest.raises(ValueError, match="undefined pad"):
+            _check_filter_graph([], 1, ["-map", "[vout]"])
+        with pytest.raises(ValueError, match="consumed exactly once"):
+            _check_filter_graph(["[0:a]volume=1.0[unused]"], 1, ["-map", "0:v"])
+    
+    def test_nvenc_preset_mapping(self):
+        """Test that x264 preset names are translated for NVENC."""
+        args = _video_encoder_args("veryslow", 23, use_nvenc=True)
+        assert args[args.index("-preset") + 1] == "p7"
+        assert args[args.index("-cq") + 1] == "23"
+
+
+# (inputs taken from shared_inputs, extra kwargs, fragments expected in the command, fragments that must be absent)
+AUDIO_CASES = [
+    pytest.param((
+        ("voice_path", "music_path"), {},
+        [
+            "[1:a]asplit=2[voice_a][voice_sc]",
+            "[2:a][voice_sc]sidechaincompress=threshold=-20dB:ratio=8:attack=20:release=300[music_ducked]",
+            "[voice_a][music_ducked]amix=inputs=2:duration=first:weights='1.0 0.3'",
+            ",loudnorm=I=-14:TP=-1.5:LRA=11:dual_mono=true[final_audio]",
+        ],
+        ["[0:a]", "volume="],
+    ), id="voice-ducks-music"),
+    pytest.param((
+        ("voice_path",), {"target_lufs": -16},
+        ["[1:a]volume=1.0,loudnorm=I=-16:", "-map [final_audio]"],
+        ["amix", "sidechaincompress"],
+    ), id="voice-loudnorm-target"),
+    pytest.param((
+        ("voice_path",), {"target_lufs": None},
+        ["[1:a]volume=1.0[final_audio]"],
+        ["loudnorm"],
+    ), id="voice-without-loudnorm"),
+    pytest.param((
+        ("music_path",), {},
+        ["[1:a]volume=0.5[final_audio]"],
+        ["loudnorm", "[2:a]"],
+    ), id="music-only-second-input"),
+    pytest.param((
+        (), {},
+        ["-map [vout] -map 0:a?"],
+        ["final_audio"],
+    ), id="clip-audio-passthrough"),
+]
+
+
+@pytest.fixture(params=AUDIO_CASES)
+def audio_command(request, shared_inputs):
+    """Build each audio case once and join it once; returns (cmd, cmd_str, expected, absent)."""
+    inputs, kwargs, expected, absent = request.param
+    paths = {name: shared_inputs[name] for name in inputs}
+    with patch('auto_edit._detect_nvenc', return_value=False):
+        cmd = _build_ffmpeg_command(
+            Path("clip.mp4"), Path("out.mp4"), paths.get("voice_path"), paths.get("music_path"), None,
+            no_burn=True, **kwargs
+        )
+    return cmd, " ".join(cmd), expected, absent
+
+
+class TestAudioMix:
+    def test_audio_graph(self, audio_command):
+        """Test the audio chains built for each voice/music combination."""
+        cmd, cmd_str, expected, absent = audio_command
+        
+        for fragment in expected:
+            assert fragment in cmd_str
+        for fragment in absent:
+            assert fragment not in cmd_str
+        assert cmd_str.count("amix") <= 1
+    
+    def test_audio_output_settings(self, audio_command):
+        """Test that every case keeps the 44.1kHz stereo output and the output path last."""
+        cmd, cmd_str, expected, absent = audio_command
+        
+        assert cmd[-5:] == ["-ar", "44100", "-ac", "2", "out.mp4"]
+
+
+# Every encoder style against every optional input combination
+SWEEP_CASES = [
+    pytest.param(case, id="-".join(map(str, case)))
+    for case in product(("ultrafast", "faster", "slow"), (18, 23), (False, True), (False, True))
+]
+
+
+@pytest.fixture(scope="session")
+def sweep_ass_path(shared_inputs, tmp_path_factory):
+    """The shared SRT converted to ASS once, as run() hands it to the command builder."""
+    return _srt_to_ass(shared_inputs["srt_path"], tmp_path_factory.mktemp("sweep") / "subs.ass")
+
+
+@pytest.fixture(params=SWEEP_CASES)
+def sweep_command(request, shared_inputs, sweep_ass_path):
+    """Build one command per (preset, crf, has_music, has_subs) combination, with voice always present."""
+    preset, crf, has_music, has_subs = request.param
+    with patch('auto_edit._detect_nvenc', return_value=False):
+        cmd = _build_ffmpeg_command(
+            Path("clip.mp4"), Path("out.mp4"), shared_inputs["voice_path"],
+            shared_inputs["music_path"] if has_music else None,
+            sweep_ass_path if has_subs else None,
+            no_burn=False, preset=preset, crf=crf
+        )
+    return cmd, request.param
+
+
+class TestCommandSweep:
+    def test_encoder_and_inputs(self, sweep_command):
+        """Test encoder settings, input count and graph contents for each combination."""
+        cmd, (preset, crf, has_music, has_subs) = sweep_command
+        graph = cmd[cmd.index("-filter_complex") + 1]
+        
+        assert cmd[cmd.index("-preset") + 1] == preset
+        assert cmd[cmd.index("-crf") + 1] == str(crf)
+        assert cmd.count("-i") == 2 + has_music
+        assert ("sidechaincompress" in graph) == has_music
+        assert ("ass=" in graph) == has_subs
+        assert cmd[-1] == "out.mp4"
+
+
+class TestSrtToAss:
+    def test_converts_srt_events(self, tmp_path):
+        """Test SRT entries become ASS dialogue lines with the burn-in style."""
+        srt_path = tmp_path / "subs.srt"
+        srt_path.write_text(
+            "1\n00:00:00,000 --> 00:00:02,500\nFirst line\n\n"
+            "2\n00:00:02,500 --> 00:01:05,040\nSecond\nline\n",
+            encoding='utf-8'
+        )
+        
+        ass_path = _srt_to_ass(srt_path, tmp_path / "subs.ass")
+        content = ass_path.read_text(encoding='utf-8')
+        
+        assert "PlayResX: 1080\nPlayResY: 1920" in content
+        assert "Style: Default,Arial,72," in content
+        assert "Dialogue: 0,0:00:00.00,0:00:02.50,Default,,0,0,0,,First line" in content
+        assert "Dialogue: 0,0:00:02.50,0:01:05.04,Default,,0,0,0,,Second\\Nline" in content
+    
+    def test_reuses_up_to_date_ass(self, tmp_path):
+        """Test the ASS file is not rewritten while newer than the SRT."""
+        srt_path = tmp_path / "subs.srt"
+        ass_path = tmp_path / "subs.ass"
+        srt_path.write_text("1\n00:00:00,000 --> 00:00:01,000\nHello\n")
+        _srt_to_ass(srt_path, ass_path)
+        ass_path.write_text(ass_path.read_text() + "cached")
+        
+        _srt_to_ass(srt_path, ass_path)
+        assert ass_path.read_text().endswith("cached")
+        
+        # A different style invalidates the cached file
+        _srt_to_ass(srt_path, ass_path, size=96)
+        content = ass_path.read_text()
+        assert "Style: Default,Arial,96," in content
+        assert not content.endswith("cached")
+    
+    def test_translates_markup_and_escapes_overrides(self, tmp_path):
+        """Test SRT tags become ASS overrides and literal braces or backslashes stay text."""
+        srt_path = tmp_path / "subs.srt"
+        srt_path.write_text(
+            '1\n00:00:00,000 --> 00:00:01,000\n<i>Deep</i> <font color="#ff8000">reef</font>\n{x} a\\N\n',
+            encoding='utf-8'
+        )
+        
+        content = _srt_to_ass(srt_path, tmp_path / "subs.ass").read_text(encoding='utf-8')
+        
+        # The backslash in the text is followed by a word joiner (U+2060) so \N stays literal
+        assert "{\\i1}Deep{\\i0} {\\c&H0080FF&}reef{\\c}\\N\\{x\\} a\\\u2060N" in content
+    
+    @pytest.mark.parametrize("srt_bytes", [
+        pytest.param(b"1\n00:01,000 --> 00:02,000\nShort timestamps\n", id="mm-ss-timestamps"),
+        pytest.param("1\n00:00:00,000 --> 00:00:01,000\nPlongée\n".encode('latin-1'), id="latin-1"),
+    ])
+    def test_unconvertible_srt_falls_back_to_subtitles_filter(self, tmp_path, srt_bytes):
+        """Test that an SRT the converter cannot read is burned in by ffmpeg's subtitles filter instead."""
+        srt_path = tmp_path / "subs.srt"
+        srt_path.write_bytes(srt_bytes)
+        
+        with patch('auto_edit._probe_clip', return_value=None), \
+             patch('auto_edit._detect_nvenc', return_value=False), \
+             patch('auto_edit._audio_encoder_args', return_value=("-c:a", "aac")):
+            clip_info, subs_path = _prepare_inputs(Path("clip.mp4"), tmp_path / "out.mp4", srt_path, False)
+            cmd = _build_ffmpeg_command(
+                Path("clip.mp4"), Path("out.mp4"), None, None, subs_path, no_burn=False
+            )
+        
+        assert subs_path == srt_path
+        graph = cmd[cmd.index("-filter_complex") + 1]
+        assert "subtitles=" in graph and "force_style=" in graph
+        assert "ass=" not in graph
+        # Same size as the converted ASS: the fallback renders at the output PlayRes too
+        assert "PlayResX=1080,PlayResY=1920" in graph and "FontSize=72" in graph
+
+
+class TestRun:
+    def test_placeholder_without_ffmpeg(self, shared_inputs, tmp_path, read_head):
+        """Test that a missing ffmpeg goes straight to the placeholder."""
+        out_path = tmp_path / "shorts" / "out.mp4"
+        
+        with patch('auto_edit._FFMPEG_BIN', None), patch('subprocess.run') as mock_run:
+            run(shared_inputs["clip_path"], out_path, voice_path=shared_inputs["voice_path"])
+            
+            assert not mock_run.called
+        
+        head = read_head(out_path)
+        assert head.startswith(b"# Placeholder composition file\n")
+        assert f"# Voice: {shared_inputs['voice_path']}".encode() in head
+        assert b"ffmpeg not found" in head
+    
+    def test_output_renamed_into_place(self, shared_inputs, tmp_path):
+        """Test that ffmpeg writes a .part file which only replaces the output on success."""
+        out_path = tmp_path / "out.mp4"
+        
+        def fake_ffmpeg(cmd, quiet):
+            assert cmd[-1].endswith("out.mp4.part")
+            assert cmd[cmd.index("-f", cmd.index("-filter_complex")) + 1] == "mp4"
+            Path(cmd[-1]).write_text("video")
+        
+        with patch('auto_edit._FFMPEG_BIN', "ffmpeg"), \
+             patch('auto_edit._prepare_inputs', return_value=(None, None)), \
+             patch('auto_edit._detect_nvenc', return_value=False), \
+             patch('auto_edit._run_ffmpeg', side_effect=fake_ffmpeg):
+            run(shared_inputs["clip_path"], out_path)
+        
+        assert out_path.read_text() == "video"
+        assert not (tmp_path / "out.mp4.part").exists()
+    
+    def test_failed_output_leaves_no_part_file(self, shared_inputs, tmp_path, read_head):
+        """Test that a failing ffmpeg run removes its partial output."""
+        out_path = tmp_path / "out.mp4"
+        
+        def failing_ffmpeg(cmd, quiet):
+            Path(cmd[-1]).write_text("half a video")
+            raise subprocess.CalledProcessError(1, cmd, stderr=b"Conversion failed!")
+        
+        with patch('auto_edit._FFMPEG_BIN', "ffmpeg"), \
+             patch('auto_edit._prepare_inputs', return_value=(None, None)), \
+             patch('auto_edit._detect_nvenc', return_value=False), \
+             patch('auto_edit._run_ffmpeg', side_effect=failing_ffmpeg):
+            run(shared_inputs["clip_path"], out_path)
+        
+        assert b"Conversion failed!" in read_head(out_path)
+        assert not (tmp_path / "out.mp4.part").exists()
+    
+    @pytest.mark.parametrize("nvenc, batch_size, expected", [
+        (False, None, [7]),
+        (True, None, [NVENC_MAX_SESSIONS, NVENC_MAX_SESSIONS, 7 - 2 * NVENC_MAX_SESSIONS]),
+        (True, 4, [4, 3]),
+    ])
+    def test_batch_size_respects_nvenc_sessions(self, shared_inputs, tmp_path, nvenc, batch_size, expected):
+        """Test that NVENC batches stay within the encoder session limit unless sized explicitly."""
+        jobs = [
+            {"clip_path": shared_inputs["clip_path"], "out_path": tmp_path / f"out_{i}.mp4"}
+            for i in range(7)
+        ]
+        sizes = []
+        
+        def fake_ffmpeg(cmd, quiet):
+            outputs = [arg for arg in cmd if arg.endswith(".mp4.part")]
+            sizes.append(len(outputs))
+            for output in outputs:
+                Path(output).write_text("video")
+        
+        with patch('auto_edit._FFMPEG_BIN', "ffmpeg"), \
+             patch('auto_edit._prepare_inputs', return_value=(None, None)), \
+             patch('auto_edit._detect_nvenc', return_value=nvenc), \
+             patch('auto_edit._run_ffmpeg', side_effect=fake_ffmpeg):
+            run_batch(jobs, quiet=True, batch_size=batch_size)
+        
+        assert sizes == expected
+        assert all(job["out_path"].read_text() == "video" for job in jobs)
+    
+    def test_batch_dry_run_encodes_nothing(self, shared_inputs, tmp_path, capsys):
+        """Test that --batch --dry-run reports the batched commands as JSON without running or converting anything."""
+        jobs_path = tmp_path / "jobs.json"
+        jobs_path.write_text(json.dumps([
+            {"clip": str(shared_inputs["clip_path"]), "out": str(tmp_path / f"out_{i}.mp4"), "srt": str(shared_inputs["srt_path"])}
+            for i in range(4)
+        ]))
+        argv = ["auto_edit.py", "--batch", str(jobs_path), "--batch-size", "3", "--dry-run", "--json"]
+        
+        with patch('sys.argv', argv), \
+             patch('auto_edit._FFMPEG_BIN', "ffmpeg"), \
+             patch('auto_edit._probe_clip', return_value=None), \
+             patch('auto_edit._detect_nvenc', return_value=False), \
+             patch('auto_edit._run_ffmpeg') as mock_ffmpeg:
+            main()
+        
+        assert not mock_ffmpeg.called
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["jobs.json"]
+        out = capsys.readouterr().out
+        batches = json.loads(out[out.index("\n{\n") + 1:])["batches"]
+        
+        assert [len(batch["shorts"]) for batch in batches] == [3, 1]
+        assert [arg for arg in batches[0]["command"] if arg.endswith(".part")] == [
+            str(tmp_path / f"out_{i}.mp4.part") for i in range(3)
+        ]
+        assert "subtitles=" in batches[0]["command"][batches[0]["command"].index("-filter_complex") + 1]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
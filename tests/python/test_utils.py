@@ -2,11 +2,26 @@
 Shared utilities for testing the content-engine.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import json
+import os
+import subprocess
 import tempfile
 import shutil
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
+import sys
+
+try:
+    import orjson
+except ImportError:
+    # Optional C encoder for create_temp_json
+    orjson = None
+
+# Probe media with the same cached ffprobe helper the vision service ships
+sys.path.insert(0, str(Path(__file__).parent.parent.parent / "services" / "vision"))
+
+from _probe import probe
 
 
 class TestContext:
@@ -15,10 +30,14 @@ class TestContext:
     def __init__(self, keep_files: bool = False):
         self.keep_files = keep_files
         self.temp_dir = None
+        self._temp_str = None
         self.fixtures_dir = Path(__file__).parent.parent / "fixtures"
+        # Fixture paths already found to exist, so each one is stat'ed once per context
+        self._fixture_cache: Dict[str, Path] = {}
     
     def __enter__(self):
-        self.temp_dir = Path(tempfile.mkdtemp(prefix="content_engine_test_"))
+        self._temp_str = tempfile.mkdtemp(prefix="content_engine_test_")
+        self.temp_dir = Path(self._temp_str)
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -29,9 +48,12 @@ class TestContext:
     
     def get_fixture(self, name: str) -> Path:
         """Get path to a test fixture."""
-        fixture_path = self.fixtures_dir / name
-        if not fixture_path.exists():
-            raise FileNotFoundError(f"Test fixture not found: {name}")
+        fixture_path = self._fixture_cache.get(name)
+        if fixture_path is None:
+            fixture_path = self.fixtures_dir / name
+            if not fixture_path.exists():
+                raise FileNotFoundError(f"Test fixture not found: {name}")
+            self._fixture_cache[name] = fixture_path
         return fixture_path
     
     def copy_fixture(self, name: str, dest_name: Optional[str] = None) -> Path:
@@ -40,55 +62,75 @@ class TestContext:
             dest_name = name
         
         src = self.get_fixture(name)
-        dest = self.temp_dir / dest_name
-        dest.parent.mkdir(parents=True, exist_ok=True)
+        dest = self._temp_path(dest_name)
         
-        shutil.copy2(src, dest)
+        # Copies never need the fixture's timestamps; copyfile skips copystat and uses sendfile on Linux
+        shutil.copyfile(src, dest)
         return dest
     
     def create_temp_file(self, name: str, content: str) -> Path:
         """Create a temporary file with content."""
-        path = self.temp_dir / name
-        path.parent.mkdir(parents=True, exist_ok=True)
-        path.write_text(content, encoding='utf-8')
-        return path
+        return self._write_temp_bytes(name, content.encode('utf-8'))
     
     def create_temp_json(self, name: str, data: Dict[str, Any]) -> Path:
-        """Create a temporary JSON file."""
-        content = json.dumps(data, indent=2, ensure_ascii=False)
-        return self.create_temp_file(name, content)
+        """
+        Create a temporary JSON file (2-space indent, UTF-8), serialized straight to bytes with orjson if installed.
+        Both encoders accept non-str keys and give the same data, though orjson formats some floats differently.
+        """
+        if orjson is not None:
+            content = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        else:
+            content = json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+        return self._write_temp_bytes(name, content)
+    
+    def _write_temp_bytes(self, name: str, content: bytes) -> Path:
+        """Write already encoded content to a temp file in a single write call."""
+        path = self._temp_path(name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+    
+    def _temp_path(self, name: str) -> Path:
+        """Join name onto the temp dir, creating parent directories only for nested names."""
+        path = Path(os.path.join(self._temp_str, name))
+        if '/' in name or os.sep in name:
+            path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+
+def _streams_by_type(data: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Map each codec_type to its first stream; reversed so earlier streams overwrite later ones."""
+    return {stream.get('codec_type'): stream for stream in reversed(data['streams'])}
+
+
+def probe_many(paths: List[Path]) -> Dict[Path, Dict[str, Any]]:
+    """
+    Probe several files concurrently; each ffprobe runs in its own process, so threads are enough.
+    Pass an entry to assert_video_properties/assert_audio_properties as probe_data to skip probing again.
+    """
+    if not paths:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(8, len(paths))) as ex:
+        return dict(zip(paths, ex.map(probe, paths)))
 
 
 def assert_video_properties(video_path: Path, 
                           expected_width: int = 1080, 
                           expected_height: int = 1920,
                           expected_fps: float = 30.0,
-                          tolerance: float = 0.1) -> Dict[str, Any]:
+                          tolerance: float = 0.1,
+                          probe_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     Assert video has expected properties using ffprobe.
     Returns the video properties for further validation.
     """
-    import subprocess
-    import json
-    
-    cmd = [
-        'ffprobe', '-v', 'quiet', '-print_format', 'json',
-        '-show_format', '-show_streams', str(video_path)
-    ]
-    
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        data = json.loads(result.stdout)
-        
-        # Find video stream
-        video_stream = None
-        audio_stream = None
+        data = probe_data if probe_data is not None else probe(video_path)
         
-        for stream in data['streams']:
-            if stream['codec_type'] == 'video':
-                video_stream = stream
-            elif stream['codec_type'] == 'audio':
-                audio_stream = stream
+        # First stream of each type, in one pass
+        streams = _streams_by_type(data)
+        video_stream = streams.get('video')
+        audio_stream = streams.get('audio')
         
         assert video_stream is not None, "No video stream found"
         
@@ -121,7 +163,7 @@ def assert_video_properties(video_path: Path,
             'video_codec': video_stream.get('codec_name'),
             'audio_codec': audio_stream.get('codec_name') if audio_stream else None,
         }
-        
+    
     except subprocess.CalledProcessError as e:
         raise AssertionError(f"ffprobe failed: {e}")
     except json.JSONDecodeError as e:
@@ -130,29 +172,17 @@ def assert_video_properties(video_path: Path,
 
 def assert_audio_properties(audio_path: Path,
                           expected_sample_rate: int = 44100,
-                          expected_channels: int = 1) -> Dict[str, Any]:
+                          expected_channels: int = 1,
+                          probe_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     Assert audio has expected properties using ffprobe.
     Returns the audio properties for further validation.
     """
-    import subprocess
-    import json
-    
-    cmd = [
-        'ffprobe', '-v', 'quiet', '-print_format', 'json',
-        '-show_format', '-show_streams', str(audio_path)
-    ]
-    
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        data = json.loads(result.stdout)
+        data = probe_data if probe_data is not None else probe(audio_path)
         
         # Find audio stream
-        audio_stream = None
-        for stream in data['streams']:
-            if stream['codec_type'] == 'audio':
-                audio_stream = stream
-                break
+        audio_stream = _streams_by_type(data).get('audio')
         
         assert audio_stream is not None, "No audio stream found"
         
@@ -172,7 +202,7 @@ def assert_audio_properties(audio_path: Path,
             'codec': audio_stream.get('codec_name'),
             'bit_rate': audio_stream.get('bit_rate'),
         }
-        
+    
     except subprocess.CalledProcessError as e:
         raise AssertionError(f"ffprobe failed: {e}")
     except json.JSONDecodeError as e:
@@ -183,23 +213,23 @@ def assert_srt_format(srt_path: Path) -> list:
     """
     Validate SRT file format and return parsed subtitles.
     """
-    import re
-    
     content = srt_path.read_text(encoding='utf-8')
     
-    # Basic SRT pattern: number, timecode, text, empty line
-    pattern = r'(\d+)\n(\d{2}:\d{2}:\d{2},\d{3}) --> (\d{2}:\d{2}:\d{2},\d{3})\n(.*?)\n\n'
-    
-    matches = re.findall(pattern, content, re.DOTALL)
+    # Entries are blank-line separated blocks: number, timecode, then one or more text lines
+    blocks = [block for block in content.strip().split('\n\n') if block.strip()]
     
-    assert len(matches) > 0, "No valid SRT entries found"
+    assert len(blocks) > 0, "No valid SRT entries found"
     
     subtitles = []
-    for match in matches:
-        seq, start_time, end_time, text = match
+    for sequence, block in enumerate(blocks, start=1):
+        lines = block.strip('\n').split('\n', 2)
+        assert len(lines) == 3, f"Incomplete SRT entry: {block!r}"
+        seq, timing, text = lines
+        start_time, arrow, end_time = timing.partition(' --> ')
+        assert arrow, f"Invalid SRT timecode line: {timing!r}"
         
         # Validate sequence numbers are incremental
-        assert int(seq) == len(subtitles) + 1, f"Non-sequential subtitle number: {seq}"
+        assert seq.strip() == str(sequence), f"Non-sequential subtitle number: {seq}"
         
         # Validate time format and logic
         start_ms = parse_srt_time(start_time)
@@ -208,7 +238,7 @@ def assert_srt_format(srt_path: Path) -> list:
         assert end_ms > start_ms, f"End time before start time in subtitle {seq}"
         
         subtitles.append({
-            'sequence': int(seq),
+            'sequence': sequence,
             'start_time': start_time,
             'end_time': end_time,
             'start_ms': start_ms,
@@ -220,13 +250,17 @@ def assert_srt_format(srt_path: Path) -> list:
 
 
 def parse_srt_time(time_str: str) -> int:
-    """Parse SRT time string to milliseconds."""
-    import re
-    
-    match = re.match(r'(\d{2}):(\d{2}):(\d{2}),(\d{3})', time_str)
-    if not match:
+    """Parse SRT time string (HH:MM:SS,mmm) to milliseconds, reading the digits at their fixed offsets."""
+    t = time_str.strip()
+    if (
+        len(t) != 12 or t[2:9:3] != '::,' or not t.isascii()
+        or not (t[0:2] + t[3:5] + t[6:8] + t[9:12]).isdigit()
+    ):
         raise ValueError(f"Invalid SRT time format: {time_str}")
     
-    hours, minutes, seconds, milliseconds = map(int, match.groups())
+    hours = (ord(t[0]) - 48) * 10 + ord(t[1]) - 48
+    minutes = (ord(t[3]) - 48) * 10 + ord(t[4]) - 48
+    seconds = (ord(t[6]) - 48) * 10 + ord(t[7]) - 48
+    milliseconds = (ord(t[9]) - 48) * 100 + (ord(t[10]) - 48) * 10 + ord(t[11]) - 48
     
-    return (hours * 3600 + minutes * 60 + seconds) * 1000 + milliseconds
\ No newline at end of file
+    return (hours * 3600 + minutes * 60 + seconds) * 1000 + milliseconds